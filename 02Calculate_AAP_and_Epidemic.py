@@ -1,75 +1,55 @@
-import pandas as pd
-import sys
-from itertools import product
-
-def parse_arguments():
-    if len(sys.argv) != 3:
-        print("Usage: python script.py <inputfile> <outputfile>")
-        sys.exit(1)
-    return sys.argv[1], sys.argv[2]
-
-def read_and_prepare_data(inputfile):
-    df = pd.read_excel(inputfile)
-    df['dates'] = pd.to_datetime(df['dates'])
-    df['month'] = df['dates'].dt.strftime('%Y-%m')
-    return df
-
-def add_missing_months_and_calculate_aap(group):
-    # Create a complete list of months from 2023-01 to 2024-05
-    all_months = pd.date_range(start='2023-01', end='2024-05', freq='M').strftime('%Y-%m').tolist()
-    
-    # Identify missing months in the group
-    existing_months = group['month'].tolist()
-    missing_months = [month for month in all_months if month not in existing_months]
-    
-    # Create DataFrame for missing months
-    missing_data = pd.DataFrame({
-        'month': missing_months,
-        'prov': group['prov'].iloc[0],
-        'Normalized Cases': 0,
-        'Normalized MP Cases': 0,
-        'Normalized Positivity Rate': 0
-    })
-    
-    # Concatenate existing group with the missing data
-    group = pd.concat([group, missing_data], ignore_index=True)
-    group = group[(group['month'] >= '2023-04') & (group['month'] <= '2024-03')]#2023-04 to 2024-03
-    # Recalculate AAP
-    total_positivity_rate = group['Normalized Positivity Rate'].sum()
-    group['AAP'] = group['Normalized Positivity Rate'] / total_positivity_rate if total_positivity_rate > 0 else 0
-    
-    # Sort by month for consistency
-    group = group.sort_values(by='month').reset_index(drop=True)
-    
-    return group
-
-def calculate_cum_aap_and_ep(group):
-    group = group.sort_values(by='AAP', ascending=False).reset_index(drop=True)
-    group['CumAAP'] = group['AAP'].cumsum()
-    group['Epidemic'] = [(1 if cum_aap <= 0.75 else round((0.75 - group.at[i-1, 'CumAAP']) / app, 5)) if i > 0 and cum_aap > 0.75 and group.at[i-1, 'CumAAP'] < 0.75 else (1 if cum_aap <= 0.75 else 0) for i, (cum_aap, app) in enumerate(zip(group['CumAAP'], group['AAP']))]
-    return group
-
-def update_status(group):
-    epidemic_rows = group[group['status'] == 'Epidemic']
-    if epidemic_rows.empty:
-        return group
-    
-    epidemic_rows = epidemic_rows.sort_values(by='month')
-    epidemic_rows['month'] = pd.to_datetime(epidemic_rows['month'])
-    epidemic_rows['group'] = (epidemic_rows['month'].diff().dt.days > 62).cumsum()
-    longest_group = epidemic_rows['group'].value_counts().idxmax()
-    earliest_epidemic = epidemic_rows[epidemic_rows['group'] == longest_group].iloc[0]
-    group.at[earliest_epidemic.name, 'status'] = 'onset'
-    return group
-
-def main():
-    inputfile, outputfile = parse_arguments()
-    df = read_and_prepare_data(inputfile)
-    df = df.groupby('prov').apply(add_missing_months_and_calculate_aap).reset_index(drop=True)
-    df = df.groupby('prov').apply(calculate_cum_aap_and_ep).reset_index(drop=True)
-    df['status'] = df['Epidemic'].apply(lambda x: 'Non-epidemic' if x == 0 else 'Epidemic')
-    df = df.groupby('prov',group_keys=True).apply(update_status)
-    df.to_excel(outputfile, index=False)
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+import argparse
+from mpanalysis.epidemic import (WINDOW_START, WINDOW_END, EPIDEMIC_THRESHOLD, read_and_prepare_data, calculate_epidemic,
+                                 calculate_sliding_epidemic, bootstrap_epidemic)
+from mpanalysis.table_io import table_format, sheet_path, write_table, write_report
+from mpanalysis.profiling import phase, add_profile_arguments, start_profiling, finish_profiling
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Calculate AAP values and epidemic status.')
+    parser.add_argument('inputfile', type=str, help='Input file (parquet, csv or xlsx) with normalized cases per province and month')
+    parser.add_argument('outputfile', type=str, help='Output file, xlsx for the report or parquet/csv')
+    parser.add_argument('--window-start', type=str, default=WINDOW_START, help='First month of the analysis window, default is %(default)s')
+    parser.add_argument('--window-end', type=str, default=WINDOW_END, help='Last month of the analysis window, default is %(default)s')
+    parser.add_argument('--threshold', type=float, default=EPIDEMIC_THRESHOLD, help='CumAAP threshold of epidemic months, default is %(default)s')
+    parser.add_argument('--sliding', action='store_true', help='Compute every sliding window between --start and --end instead of one window')
+    parser.add_argument('--window-length', type=int, default=12, help='Number of months of every sliding window, default is %(default)s')
+    parser.add_argument('--step', type=int, default=1, help='Months between the starts of consecutive sliding windows, default is %(default)s')
+    parser.add_argument('--start', type=str, default=None, help='First month of the sliding windows, default is the first month in the data')
+    parser.add_argument('--end', type=str, default=None, help='Last month of the sliding windows, default is the last month in the data')
+    parser.add_argument('--bootstrap', type=int, default=0,
+                        help='Number of bootstrap replicates, adds a Bootstrap sheet (a <name>_Bootstrap file next to a non-Excel output) with percentile CIs of the epidemic month count and onset month, default is 0 (none)')
+    parser.add_argument('--ci', type=float, default=0.95, help='Level of the bootstrap CIs, default is %(default)s')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the bootstrap random number generator')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes of the bootstrap, default is 1')
+    parser.add_argument('--chunk-size', type=int, default=100,
+                        help='Bootstrap replicates per chunk, each chunk has its own random stream and bounds the memory, default is %(default)s')
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    if args.bootstrap and args.sliding:
+        raise SystemExit("--bootstrap is only available for a single window")
+    start_profiling(args)
+    df = read_and_prepare_data(args.inputfile)
+    with phase('epidemic', provinces=df['prov'].nunique()):
+        if args.sliding:
+            out_df = calculate_sliding_epidemic(df, args.window_length, args.step, args.start, args.end, args.threshold)
+        else:
+            out_df = calculate_epidemic(df, args.window_start, args.window_end, args.threshold)
+    if not args.bootstrap:
+        write_table(out_df, args.outputfile)
+    else:
+        with phase('bootstrap', replicates=args.bootstrap):
+            ci_df = bootstrap_epidemic(df, args.bootstrap, args.window_start, args.window_end, args.threshold,
+                                       args.ci, args.seed, args.workers, args.chunk_size)
+        if table_format(args.outputfile)[0] == 'excel':
+            write_report({'Sheet1': out_df, 'Bootstrap': ci_df}, args.outputfile)
+        else:
+            # The epidemic table keeps the output name for the next stage, the CIs go next to it
+            write_table(out_df, args.outputfile)
+            write_table(ci_df, sheet_path(args.outputfile, 'Bootstrap'))
+    finish_profiling(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,58 @@
-import pandas as pd
-import numpy as np
-import argparse
-
-def read_and_prepare_data(inputfile):
-    df = pd.read_csv(inputfile)
-    df['days'] = pd.to_datetime(df['days'])
-    return df
-
-def fill_missing_dates(group, full_date_range):
-    full_range_df = pd.DataFrame(full_date_range, columns=['days'])
-    filled_group = full_range_df.merge(group, on='days', how='left')
-    filled_group['Day_Cases'].fillna(0, inplace=True)
-    filled_group['Day_MP_Cases'].fillna(0, inplace=True) 
-    province_value = group['prov'].iloc[0]
-    filled_group['prov'].fillna(province_value, inplace=True)
-    return filled_group
-
-def calculate_rolling_averages(group):
-    group = group.sort_values(by='days').reset_index(drop=True)
-    group['Average_Day_Cases'] = group['Day_Cases'].rolling(window=7, min_periods=1, center=True).mean().astype(int)
-    group['Average_Day_MP_Cases'] = group['Day_MP_Cases'].rolling(window=7, min_periods=1, center=True).mean().astype(int)
-    group['Average_Day_Positivity_Rate'] = group['Average_Day_MP_Cases'] / group['Average_Day_Cases']
-    return group
-
-def calculate_n50_days(group):
-    group = group.sort_values(by='Average_Day_Positivity_Rate', ascending=False).reset_index(drop=True)
-    total_positivity_rate = group['Average_Day_Positivity_Rate'].sum()
-    cumulative_sum = group['Average_Day_Positivity_Rate'].cumsum()
-    n50_days = (cumulative_sum <= total_positivity_rate / 2).sum()
-    return n50_days
-
-def main(inputfile, outputfile1, outputfile2):
-    df = read_and_prepare_data(inputfile)
-    global_min_date = df['days'].min()
-    global_max_date = df['days'].max()
-    full_date_range = pd.date_range(start=global_min_date, end=global_max_date)
-    #print(full_date_range)
-    df = df.groupby('prov').apply(fill_missing_dates, full_date_range=full_date_range).reset_index(drop=True)
-    df = df.groupby('prov').apply(calculate_rolling_averages).reset_index(drop=True)
-    
-    results = []
-    n50_results = []
-
-    for prov, group in df.groupby('prov'):
-        n50_days = calculate_n50_days(group)
-        results.append(group)
-        n50_results.append({'prov': prov, 'N50Days': n50_days})
-    
-    final_df = pd.concat(results).sort_values(by=['prov', 'days']).reset_index(drop=True)
-    final_n50_df = pd.DataFrame(n50_results)
-
-    # Write to output files
-    final_df.to_csv(outputfile1, index=False, columns=['prov', 'days', 'Day_Cases', 'Day_MP_Cases', 'Average_Day_Cases', 'Average_Day_MP_Cases', 'Average_Day_Positivity_Rate'])
-    final_n50_df.to_csv(outputfile2, index=False)
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Process and analyze COVID data per province.')
-    parser.add_argument('inputfile', type=str, help='Input CSV file with columns: prov, days, Day_Cases, Day_MP_Cases')
-    parser.add_argument('outputfile1', type=str, help='Output CSV file for detailed results')
-    parser.add_argument('outputfile2', type=str, help='Output CSV file for N50 days results')
-
-    args = parser.parse_args()
-    main(args.inputfile, args.outputfile1, args.outputfile2)
\ No newline at end of file
+import pandas as pd
+import argparse
+import os
+from mpanalysis.n50 import (OUTPUT_COLUMNS, read_and_prepare_data, read_days_after, add_n50_ci, state_n50_days, new_state,
+                            save_state, load_state, update_state, state_last_day, state_frame, calculate_n50)
+from mpanalysis.table_io import write_table
+from mpanalysis.profiling import add_profile_arguments, start_profiling, finish_profiling
+
+def main_incremental(inputfile, outputfile1, outputfile2, state_file, bootstrap=0, ci=0.95, seed=None, workers=1, chunk_size=100):
+    """
+    Incremental daily refresh: with an existing state file only the new days of inputfile are
+    processed and outputfile1 gets the recomputed rows only, otherwise the state is built from scratch.
+    """
+    if os.path.exists(state_file):
+        state = load_state(state_file)
+        state, start = update_state(state, read_days_after(inputfile, state_last_day(state)))
+    else:
+        state, start = new_state(read_and_prepare_data(inputfile)), 0
+    save_state(state_file, state)
+
+    write_table(state_frame(state, start)[OUTPUT_COLUMNS], outputfile1)
+    n50_df = pd.DataFrame({'prov': state['provs'], 'N50Days': state_n50_days(state)})
+    if bootstrap:
+        n50_df = add_n50_ci(n50_df, state['day_cases'], state['day_mp_cases'], bootstrap, ci, seed, workers, chunk_size)
+    write_table(n50_df, outputfile2)
+
+def main(inputfile, outputfile1, outputfile2, bootstrap=0, ci=0.95, seed=None, workers=1, chunk_size=100):
+    df = read_and_prepare_data(inputfile)
+    final_df, final_n50_df = calculate_n50(df, bootstrap, ci, seed, workers, chunk_size)
+
+    # Write to output files
+    write_table(final_df, outputfile1)
+    write_table(final_n50_df, outputfile2)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Process and analyze COVID data per province.')
+    parser.add_argument('inputfile', type=str, help='Input file (csv, parquet or xlsx) with columns: prov, days, Day_Cases, Day_MP_Cases')
+    parser.add_argument('outputfile1', type=str, help='Output file for detailed results, format from the extension (csv, csv.gz, parquet)')
+    parser.add_argument('outputfile2', type=str, help='Output file for N50 days results, format from the extension')
+    parser.add_argument('--state', type=str, default=None,
+                        help='Incremental mode: state file (.npz) of earlier runs, only days after it are processed (parquet inputs with date-typed days are filtered while reading) and outputfile1 only gets the recomputed days')
+    parser.add_argument('--bootstrap', type=int, default=0,
+                        help='Number of bootstrap replicates of the N50 days, adds percentile CI columns to outputfile2, default is 0 (no CI)')
+    parser.add_argument('--ci', type=float, default=0.95, help='Level of the bootstrap CI, default is %(default)s')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the bootstrap random number generator')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes of the bootstrap, default is 1')
+    parser.add_argument('--chunk-size', type=int, default=100,
+                        help='Bootstrap replicates per chunk, each chunk has its own random stream and bounds the memory, default is %(default)s')
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+    options = dict(bootstrap=args.bootstrap, ci=args.ci, seed=args.seed, workers=args.workers, chunk_size=args.chunk_size)
+    start_profiling(args)
+    if args.state:
+        main_incremental(args.inputfile, args.outputfile1, args.outputfile2, args.state, **options)
+    else:
+        main(args.inputfile, args.outputfile1, args.outputfile2, **options)
+    finish_profiling(args)
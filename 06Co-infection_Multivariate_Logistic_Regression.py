@@ -1,96 +1,62 @@
-import pandas as pd
-import statsmodels.api as sm
-import argparse
-import sys
-import numpy as np
-
-def read_data(file_path):
-    """Reads data from a file with different formats: CSV, TXT, Excel"""
-    if file_path.endswith('.csv'):
-        return pd.read_csv(file_path)
-    elif file_path.endswith('.txt'):
-        return pd.read_csv(file_path, sep='\t')
-    elif file_path.endswith('.xls') or file_path.endswith('.xlsx'):
-        return pd.read_excel(file_path)
-    else:
-        raise ValueError("Unsupported file format. Please input a csv, txt, or xls/xlsx file.")
-
-def main(input_file, output_file, sample_fraction):
-    # Read data file
-    try:
-        data = read_data(input_file)
-    except Exception as e:
-        print(f"Failed to read input file: {e}")
-        sys.exit(1)
-
-    # Define dependent variable
-    y = data['Mycoplasma pneumoniae']
-
-    # Define covariates
-    covariates = ['region', 'site', 'age', 'sex']
-
-    # Define independent variables (excluding covariates and dependent variable)
-    bacteria_vars = [col for col in data.columns if col not in covariates + ['Mycoplasma pneumoniae'] + ['date']]
-
-    # Create an empty DataFrame to store results
-    results = pd.DataFrame(columns=['Bacteria', 'Coefficient', 'P-value', 'Std Err', 'Z', 'CI Lower (0.025)', 'CI Upper (0.975)'])
-
-    # Randomly sample data for analysis based on specified fraction
-    sample_data = data.sample(frac=sample_fraction, random_state=1)
-    sample_y = sample_data['Mycoplasma pneumoniae']
-
-    # Loop through each bacteria variable
-    for bacteria in bacteria_vars:
-        # Define the current independent variable
-        X = sample_data[covariates + [bacteria]]
-
-        # Add constant
-        X = sm.add_constant(X)
-
-        try:
-            # Fit model only if it converges
-            model = sm.Logit(sample_y, X).fit()
-
-            # Extract coefficients and p-values
-            coef = model.params[bacteria]
-            p_value = model.pvalues[bacteria]
-            std_err = model.bse[bacteria]
-            z_value = model.tvalues[bacteria]
-            ci_lower, ci_upper = model.conf_int().loc[bacteria]
-
-            # Append result to the results DataFrame
-            results = results.append({
-                'Bacteria': bacteria,
-                'Coefficient': coef,
-                'P-value': p_value,
-                'Std Err': std_err,
-                'Z': z_value,
-                'CI Lower (0.025)': ci_lower,
-                'CI Upper (0.975)': ci_upper
-            }, ignore_index=True)
-        except Exception as e:
-            print(f"Failed to fit model for {bacteria}: {e}")
-
-    # Output results to the specified file
-    try:
-        results.to_csv(output_file, sep='\t', index=False)
-        print(f"Results successfully saved to {output_file}")
-    except Exception as e:
-        print(f"Failed to write output file: {e}")
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Bacteria Analysis Tool')
-    parser.add_argument('input_file', type=str, help='Input data file (csv, txt, xlsx format)')
-    parser.add_argument('output_file', type=str, help='Output file (csv format)')
-    parser.add_argument('-f', '--fraction', type=float, default=1, help='Sample fraction (0-1) for analysis, default is 1 (use all data)')
-    parser.add_argument('-v', '--version', action='version', version='%(prog)s 1.0', help="Show program's version number and exit")
-    
-    args = parser.parse_args()
-
-    # Check if the sample fraction is within the valid range
-    if not (0 <= args.fraction <= 1):
-        print("Error: Sample fraction must be between 0 and 1.")
-        sys.exit(1)
-
-    # Execute main function
-    main(args.input_file, args.output_file, args.fraction)
\ No newline at end of file
+import argparse
+import sys
+from mpanalysis.logistic import read_data, sample_bacteria, logistic_regression, screen_interactions
+from mpanalysis.table_io import write_table
+from mpanalysis.profiling import phase, count, add_profile_arguments, start_profiling, finish_profiling
+
+def main(input_file, output_file, sample_fraction, compress=False, workers=1, interaction_file=None, screen_alpha=0.05):
+    # Read data file
+    try:
+        data = read_data(input_file)
+    except Exception as e:
+        print(f"Failed to read input file: {e}")
+        sys.exit(1)
+
+    bacteria_vars, sample_data = sample_bacteria(data, sample_fraction)
+    results, failures = logistic_regression(sample_data, bacteria_vars, compress, workers)
+    for bacteria, error in failures:
+        print(f"Failed to fit model for {bacteria}: {error}")
+
+    # Output results to the specified file
+    try:
+        write_table(results, output_file, sep='\t')
+        print(f"Results successfully saved to {output_file}")
+    except Exception as e:
+        print(f"Failed to write output file: {e}")
+
+    # Screen the pathogen pairs for interactions
+    if interaction_file:
+        with phase('screen_interactions', pairs=len(bacteria_vars) * (len(bacteria_vars) - 1) // 2):
+            interactions, failures = screen_interactions(sample_data, bacteria_vars, screen_alpha, compress, workers)
+            count(fitted=int(interactions['P-value'].notna().sum()))
+        for names, error in failures:
+            print(f"Failed to fit interaction model for {' x '.join(names) or 'main effects'}: {error}")
+        try:
+            write_table(interactions, interaction_file, sep='\t')
+            print(f"Interaction results successfully saved to {interaction_file}")
+        except Exception as e:
+            print(f"Failed to write interaction file: {e}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bacteria Analysis Tool')
+    parser.add_argument('input_file', type=str, help='Input data file (csv, txt, parquet, xlsx format)')
+    parser.add_argument('output_file', type=str, help='Output file (csv format)')
+    parser.add_argument('-f', '--fraction', type=float, default=1, help='Sample fraction (0-1) for analysis, default is 1 (use all data)')
+    parser.add_argument('-c', '--compress', action='store_true', help='Collapse identical rows and fit a frequency-weighted GLM, same estimates at a fraction of the cost')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of worker processes fitting the models, default is 1')
+    parser.add_argument('-i', '--interactions', type=str, default=None, help='Also screen all pathogen pairs for interactions and write them to this file')
+    parser.add_argument('--screen-alpha', type=float, default=0.05, help='Score test p value below which a pair gets a full interaction fit, default is 0.05')
+    add_profile_arguments(parser)
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s 1.0', help="Show program's version number and exit")
+    
+    args = parser.parse_args()
+
+    # Check if the sample fraction is within the valid range
+    if not (0 <= args.fraction <= 1):
+        print("Error: Sample fraction must be between 0 and 1.")
+        sys.exit(1)
+
+    # Execute main function
+    start_profiling(args)
+    main(args.input_file, args.output_file, args.fraction, args.compress, args.workers, args.interactions, args.screen_alpha)
+    finish_profiling(args)
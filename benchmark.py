@@ -0,0 +1,150 @@
+"""
+Time and memory benchmarks of the stage functions on synthetic inputs of growing size.
+
+Every benchmark and size runs in a fresh process: the inputs are generated first (not measured),
+then the function is timed repeat times, and run once more under tracemalloc for its peak Python
+allocation. Peak RSS is the high-water mark of the process. Results are written as JSON so runs
+on different commits can be compared.
+"""
+import io
+import os
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import importlib
+import subprocess
+from contextlib import redirect_stdout
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import synthetic_data
+from mpanalysis.normalize import normalize_cases
+from mpanalysis.profiling import peak_rss_mb
+
+# setup(module, scale, seed) returns (arguments of run, number of input rows), the base sizes are at scale 1
+Benchmark = namedtuple('Benchmark', ['module', 'setup', 'run'])
+
+def _setup_normalize(module, scale, seed):
+    df = synthetic_data.province_months(n_provs=31 * scale, seed=seed)
+    return (df,), len(df)
+
+def _setup_epidemic(module, scale, seed):
+    df = synthetic_data.province_months(n_provs=31 * scale, seed=seed)
+    normalized = normalize_cases(df, 100, seed)
+    df = module.prepare_data(pd.concat([df, normalized], axis=1))
+    return (df,), len(df)
+
+def _setup_n50(module, scale, seed):
+    df = module.prepare_data(synthetic_data.province_days(n_units=31 * scale, seed=seed))
+    return (df,), len(df)
+
+def _setup_n50_days(module, scale, seed):
+    df = module.prepare_data(synthetic_data.province_days(n_units=31 * scale, seed=seed))
+    daily, _ = module.calculate_n50(df)
+    rates = daily['Average_Day_Positivity_Rate'].to_numpy(dtype=float).reshape(daily['prov'].nunique(), -1)
+    return (rates,), len(df)
+
+def _setup_coinfection(module, scale, seed):
+    df = module.prepare_data(synthetic_data.coinfection_rows(n_rows=10000 * scale, seed=seed))
+    return (df, synthetic_data.PATHOGENS), len(df)
+
+def _setup_geodetector(module, scale, seed):
+    df = synthetic_data.factor_table(n_rows=1000 * scale, seed=seed)
+    return (df,), len(df)
+
+def _setup_logistic(module, scale, seed):
+    df = synthetic_data.pathogen_matrix(n_rows=2000 * scale, seed=seed)
+    bacteria_vars, sample_data = module.sample_bacteria(df, 1)
+    return (sample_data, bacteria_vars), len(df)
+
+BENCHMARKS = {
+    'normalize_cases': Benchmark('mpanalysis.normalize', _setup_normalize, lambda m, df: m.normalize_cases(df, 1000, 1)),
+    'calculate_epidemic': Benchmark('mpanalysis.epidemic', _setup_epidemic, lambda m, df: m.calculate_epidemic(df, '2022-04', '2024-03')),
+    'calculate_n50': Benchmark('mpanalysis.n50', _setup_n50, lambda m, df: m.calculate_n50(df)),
+    'calculate_n50_days': Benchmark('mpanalysis.n50', _setup_n50_days, lambda m, rates: m.calculate_n50_days(rates)),
+    'coinfection_statistics': Benchmark('mpanalysis.coinfection', _setup_coinfection,
+                                        lambda m, df, blist: m.coinfection_statistics(df, blist)),
+    'geodetector_report': Benchmark('mpanalysis.geodetector', _setup_geodetector, lambda m, df: m.geodetector_report(df)),
+    'logistic_regression': Benchmark('mpanalysis.logistic', _setup_logistic,
+                                     lambda m, sample_data, bacteria_vars: m.logistic_regression(sample_data, bacteria_vars)),
+}
+
+def run_case(name, scale, repeat, seed):
+    """Measurements of one benchmark at one scale, meant to run in its own process."""
+    benchmark = BENCHMARKS[name]
+    module = importlib.import_module(benchmark.module)
+    args, n_rows = benchmark.setup(module, scale, seed)
+    setup_rss = peak_rss_mb()
+
+    seconds = []
+    # The fitting progress printed by statsmodels is dropped
+    with redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            benchmark.run(module, *args)
+            seconds.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        benchmark.run(module, *args)
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        'benchmark': name,
+        'scale': scale,
+        'rows': n_rows,
+        'seconds': seconds,
+        'min_seconds': min(seconds),
+        'median_seconds': float(np.median(seconds)),
+        'tracemalloc_peak_mb': traced_peak / 2 ** 20,
+        'setup_peak_rss_mb': setup_rss,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'cpus': os.cpu_count(),
+    }
+
+def run_benchmarks(names, scales, repeat=3, seed=1):
+    results = []
+    for name in names:
+        for scale in scales:
+            # A fresh process per case, so its peak RSS is not inherited from the earlier cases
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(run_case, name, scale, repeat, seed).result()
+            print(f"{name:24s} scale {scale:4d} {result['rows']:10d} rows {result['min_seconds']:10.4f} s "
+                  f"{result['tracemalloc_peak_mb']:10.1f} MB traced {result['peak_rss_mb'] or float('nan'):10.1f} MB RSS")
+            results.append(result)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the stage functions on synthetic inputs.')
+    parser.add_argument('-o', '--output', type=str, default='benchmark.json', help='JSON file of the results, default is %(default)s')
+    parser.add_argument('-b', '--benchmarks', nargs='+', default=list(BENCHMARKS), choices=list(BENCHMARKS),
+                        help='Benchmarks to run, default is all')
+    parser.add_argument('-s', '--scales', nargs='+', type=int, default=[1, 4, 16],
+                        help='Multiples of the base input sizes, default is %(default)s')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Timed runs per case, default is %(default)s')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the synthetic inputs, default is %(default)s')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.benchmarks, args.scales, args.repeat, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
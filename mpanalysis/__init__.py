@@ -0,0 +1,21 @@
+"""
+Importable analysis functions of the numbered scripts, which are thin command line wrappers of them.
+
+    normalize     01 normalization of the monthly cases
+    epidemic      02 AAP and epidemic status
+    n50           03 rolling averages and N50 days
+    coinfection   04 co-infection statistics
+    geodetector   05 geographic detector
+    logistic      06 logistic regression and interaction screening
+    table_io      table reading and writing by file extension
+    profiling     phase timing of --profile
+    parallel      seeded chunks of replicates, optionally in a process pool
+
+The api functions (normalize_table, epidemic_table, ...) take and return DataFrames. scipy and
+statsmodels are only imported when a function needing them runs.
+"""
+from .api import (normalize_table, epidemic_table, n50_tables, coinfection_tables, geodetector_tables,
+                  logistic_table, interaction_table)
+
+__all__ = ['normalize_table', 'epidemic_table', 'n50_tables', 'coinfection_tables', 'geodetector_tables',
+           'logistic_table', 'interaction_table']
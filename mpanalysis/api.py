@@ -0,0 +1,38 @@
+"""
+In-process entry points of the stages: every function takes the input DataFrame of its stage as
+read from the input file, leaves it unchanged and returns DataFrames, so a long-lived process can
+call them without starting a script or writing files per request.
+"""
+import pandas as pd
+from . import normalize, epidemic, n50, coinfection, geodetector, logistic
+
+def normalize_table(df, k=1000, seed=None, workers=1, shard_size=1000):
+    """01: df with the normalized cases, MP cases and positivity rate appended."""
+    return pd.concat([df, normalize.normalize_cases_sharded(df, k, seed, workers, shard_size)], axis=1)
+
+def epidemic_table(df, window_start=epidemic.WINDOW_START, window_end=epidemic.WINDOW_END,
+                   threshold=epidemic.EPIDEMIC_THRESHOLD):
+    """02: AAP, CumAAP, Epidemic and status of every province and month of the window, df is the output of 01."""
+    return epidemic.calculate_epidemic(epidemic.prepare_data(df), window_start, window_end, threshold)
+
+def n50_tables(df, bootstrap=0, ci=0.95, seed=None, workers=1, chunk_size=100):
+    """03: daily rolling averages and N50 days (with bootstrap CIs if bootstrap > 0) of every province."""
+    return n50.calculate_n50(n50.prepare_data(df), bootstrap, ci, seed, workers, chunk_size)
+
+def coinfection_tables(df, blist, groupings=coinfection.GROUP_COLUMNS):
+    """04: {grouping: co-infection statistics} of the co-infection rows, blist are the pathogens reported."""
+    return coinfection.coinfection_statistics(coinfection.prepare_data(df), blist, groupings)
+
+def geodetector_tables(df, permutations=0, bootstrap=0, workers=1, seed=None, discretize=()):
+    """05: {sheet name: detector table}, y is the first column of df and the other columns are the factors."""
+    return geodetector.geodetector_report(df, permutations, bootstrap, workers, seed, discretize)
+
+def logistic_table(df, fraction=1, compress=False, workers=1):
+    """06: coefficient of every pathogen column of df in its logistic regression of MP on the covariates, and the failed fits."""
+    bacteria_vars, sample_data = logistic.sample_bacteria(df, fraction)
+    return logistic.logistic_regression(sample_data, bacteria_vars, compress, workers)
+
+def interaction_table(df, alpha=0.05, fraction=1, compress=False, workers=1):
+    """06: score test of every pathogen pair and the interaction fit of the pairs below alpha, and the failed fits."""
+    bacteria_vars, sample_data = logistic.sample_bacteria(df, fraction)
+    return logistic.screen_interactions(sample_data, bacteria_vars, alpha, compress, workers)
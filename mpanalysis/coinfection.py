@@ -0,0 +1,386 @@
+"""
+Co-infection statistics of MP with the other pathogens per stratum (04), and the all-pairs
+pathogen co-occurrence. scipy is only imported by the co-occurrence functions.
+"""
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from .table_io import read_table, iter_table, table_format
+from .profiling import phase, timed, count
+
+MP = 'Mycoplasma pneumoniae'
+TOP_N = 100
+
+# Every distinct BacteriaList is stored once as uint64 words, one bit per pathogen;
+# rows only keep the code of their BacteriaList.
+PathogenPanel = namedtuple('PathogenPanel', ['pathogens', 'masks', 'codes', 'n_tokens', 'is_mp'])
+# Counts of every combination of the group keys (one cell per row of `cells`),
+# from which any grouping over those keys is answered.
+CoinfectionCube = namedtuple('CoinfectionCube', ['cells', 'counts', 'bacteria'])
+# CaseCount-weighted pathogen x pathogen co-occurrence matrix of every cell, over all pathogens.
+CooccurrenceCube = namedtuple('CooccurrenceCube', ['cells', 'matrices', 'totals', 'pathogens'])
+
+GROUP_COLUMNS = ['Province', 'InfectionSite', 'AgeGroup', 'Gender']
+COOCCURRENCE_COLUMNS = ['Grouping', 'Stratum', 'Total Cases', 'Bacteria 1', 'Bacteria 2', 'Bacteria 1 Cases', 'Bacteria 2 Cases',
+                        'Co-occurrence', 'Expected', 'O/E Ratio']
+RESULT_COLUMNS = ['Total Cases', 'Co-MP Cases', 'S_MP Cases', 'Non-MP Cases', 'Bacteria', 'MP Count', 'Co-MP Rate', 'Non-MP Rate', 'Bacteria Count Non-MP']
+
+NORTH_REGIONS = ['Neimengol', 'Heilongjiang', 'Jilin', 'Liaoning', 'Beijing', 'Tianjin', 'Hebei', 'Shanxi', 'Shaanxi', 'Gansu', 'Ningxia', 'Henan', 'Shandong', 'Xinjiang']
+SOUTH_REGIONS = ['Jiangsu', 'Anhui', 'Hubei', 'Sichuan', 'Chongqing', 'Yunnan', 'Guizhou', 'Guangxi', 'Guangdong', 'Fujian', 'Zhejiang', 'Jiangxi', 'Hunan', 'Hainan', 'Shanghai']
+REGION_GROUPS = {**{prov: 'N' for prov in NORTH_REGIONS}, **{prov: 'S' for prov in SOUTH_REGIONS}}
+INPUT_COLUMNS = ['Province', 'Time', 'InfectionSite', 'AgeGroup', 'Gender', 'BacteriaList', 'CaseCount']
+# Low-cardinality text columns, read as categoricals; AgeGroup holds the ages until prepare_data
+CATEGORY_COLUMNS = ['Province', 'InfectionSite', 'Gender']
+
+def process_age_group(ages):
+    return pd.Series(np.where(ages < 18, '18-', '18+'), index=ages.index)
+
+def process_region_group(provinces):
+    return provinces.map(REGION_GROUPS).fillna('XQ')
+
+def prepare_data(df):
+    """Copy of df with age and region groups, rows outside the regions are dropped; df itself is left unchanged."""
+    if 'AgeGroup' in df:
+        df = df.assign(AgeGroup=process_age_group(df['AgeGroup']))
+    df = df.assign(Province=process_region_group(df['Province']))
+    df = df[df['Province'] != 'XQ'].reset_index(drop=True)
+    for column in GROUP_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype('category')
+    return df
+
+def input_options(file_path, keys=None):
+    """
+    Reader arguments of the input file: only the columns needed for keys (all if None) are read,
+    text files have a title line above the header and are comma separated.
+    """
+    options = {}
+    if keys is not None:
+        options['columns'] = list(dict.fromkeys(['Province'] + list(keys) + ['BacteriaList', 'CaseCount']))
+    if table_format(file_path)[0] == 'text':
+        options.update(sep=',', header=1, names=INPUT_COLUMNS)
+    return options
+
+def read_txt_file(file_path, keys=None):
+    options = input_options(file_path, keys)
+    categories = [column for column in CATEGORY_COLUMNS if column in options.get('columns', INPUT_COLUMNS)]
+    df = read_table(file_path, categories=categories, **options)
+    return prepare_data(df)
+
+def iter_txt_file(file_path, chunksize, keys=None):
+    """Read the input file in chunks of chunksize rows, each prepared like read_txt_file."""
+    for chunk in iter_table(file_path, chunksize, **input_options(file_path, keys)):
+        yield prepare_data(chunk)
+
+@timed()
+def encode_pathogens(bacteria_lists):
+    """
+    Encode a BacteriaList column as a PathogenPanel.
+
+    The semicolon strings are parsed once per distinct value, each distinct pathogen
+    is mapped to a bit, and each row keeps the code of its BacteriaList.
+    """
+    codes, uniques = pd.factorize(bacteria_lists.fillna(''), sort=False)
+    uniques = pd.Series(uniques, dtype=object)
+    tokens = uniques.str.split(';').explode()
+    token_codes, pathogens = pd.factorize(tokens, sort=False)
+    list_codes = tokens.index.to_numpy()
+
+    n_words = max(1, (len(pathogens) + 63) // 64)
+    masks = np.zeros((len(uniques), n_words), dtype=np.uint64)
+    bits = np.left_shift(np.uint64(1), (token_codes % 64).astype(np.uint64))
+    np.bitwise_or.at(masks, (list_codes, token_codes // 64), bits)
+
+    n_tokens = uniques.str.count(';').to_numpy() + 1
+    is_mp = uniques.str.contains(MP, regex=False).to_numpy(dtype=bool)
+    count(rows=len(codes), bacteria_lists=len(masks), pathogens=len(pathogens))
+    return PathogenPanel(list(pathogens), masks, codes.astype(np.int32), n_tokens, is_mp)
+
+def pathogen_bit(panel, index):
+    """Boolean array telling which distinct BacteriaList contains the pathogen at index."""
+    word, bit = divmod(index, 64)
+    return ((panel.masks[:, word] >> np.uint64(bit)) & np.uint64(1)).astype(bool)
+
+def reduce_pairs(cell_codes, weights, panel):
+    """Reduce the rows to distinct (cell, BacteriaList) pairs, sorted by cell, with summed weights and row counts."""
+    valid = cell_codes >= 0
+    n_lists = len(panel.n_tokens)
+    pairs = cell_codes[valid].astype(np.int64) * n_lists + panel.codes[valid]
+    pairs, inverse = np.unique(pairs, return_inverse=True)
+    pair_weights = np.bincount(inverse, weights=weights[valid])
+    pair_rows = np.bincount(inverse)
+    pair_cells, pair_lists = np.divmod(pairs, n_lists)
+    return pair_cells, pair_lists, pair_weights, pair_rows
+
+def count_cells(cell_codes, n_cells, weights, panel, candidates):
+    """
+    Weighted MP / co-MP / non-MP totals and per-pathogen counts for every cell.
+
+    Rows are first reduced to distinct (cell, BacteriaList) pairs, so all counts are
+    bitwise ops plus weighted bincounts over those pairs.
+
+    :param cell_codes: integer cell of every row, -1 for rows outside any cell
+    :param n_cells: number of cells
+    :param weights: CaseCount of every row
+    :param panel: PathogenPanel of the rows
+    :param candidates: indices of the pathogens counted in MP co-infections
+    :return: dict of per-cell arrays
+    """
+    pair_cells, pair_lists, pair_weights, pair_rows = reduce_pairs(cell_codes, weights, panel)
+
+    is_mp = panel.is_mp[pair_lists]
+    is_co = is_mp & (panel.n_tokens[pair_lists] != 1)
+
+    def cell_sum(mask, values=pair_weights):
+        return np.bincount(pair_cells[mask], weights=values[mask], minlength=n_cells)
+
+    counts = {
+        'total': cell_sum(slice(None)),
+        'co_mp': cell_sum(is_co),
+        's_mp': cell_sum(is_mp & ~is_co),
+        'mp_count': np.zeros((n_cells, len(candidates))),
+        'mp_rows': np.zeros((n_cells, len(candidates))),
+        'nomp_count': np.zeros((n_cells, len(candidates))),
+    }
+    for j, index in enumerate(candidates):
+        has = pathogen_bit(panel, index)[pair_lists]
+        counts['mp_count'][:, j] = cell_sum(is_co & has)
+        counts['mp_rows'][:, j] = cell_sum(is_co & has, pair_rows)
+        counts['nomp_count'][:, j] = cell_sum(~is_mp & has)
+    return counts
+
+def incidence_matrix(panel):
+    """Sparse BacteriaList x pathogen incidence matrix of the panel."""
+    import scipy.sparse as sp
+    rows, columns = [], []
+    for word in range(panel.masks.shape[1]):
+        bits = np.unpackbits(panel.masks[:, word].astype('<u8').view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+        list_index, bit = np.nonzero(bits)
+        rows.append(list_index)
+        columns.append(bit + 64 * word)
+    rows, columns = np.concatenate(rows), np.concatenate(columns)
+    keep = columns < len(panel.pathogens)
+    return sp.csr_matrix((np.ones(keep.sum()), (rows[keep], columns[keep])), shape=(len(panel.n_tokens), len(panel.pathogens)))
+
+def cooccurrence_cells(cell_codes, n_cells, weights, panel):
+    """
+    CaseCount-weighted pathogen co-occurrence matrix X^T W X of every cell.
+
+    :return: list of sparse pathogen x pathogen matrices and the total cases of every cell
+    """
+    import scipy.sparse as sp
+    pair_cells, pair_lists, pair_weights, _ = reduce_pairs(cell_codes, weights, panel)
+    incidence = incidence_matrix(panel)[pair_lists]
+    bounds = np.searchsorted(pair_cells, np.arange(n_cells + 1))
+    matrices = []
+    for c in range(n_cells):
+        X = incidence[bounds[c]:bounds[c + 1]]
+        W = sp.diags(pair_weights[bounds[c]:bounds[c + 1]])
+        matrices.append(sp.csr_matrix(X.T @ W @ X))
+    totals = np.bincount(pair_cells, weights=pair_weights, minlength=n_cells)
+    return matrices, totals
+
+@timed()
+def build_cube(df, panel, keys, blist):
+    """
+    Count all pathogens for every combination of the keys in a single pass over the rows.
+
+    :param df: co-infection DataFrame
+    :param panel: PathogenPanel of df
+    :param keys: group key columns of the cube
+    :param blist: pathogens counted in MP co-infections
+    :return: CoinfectionCube
+    """
+    grouped = df.groupby(keys, observed=True, dropna=False)
+    cell_codes = grouped.ngroup().to_numpy()
+    cells = grouped.size().index.to_frame(index=False)
+
+    candidates = [i for i, bacteria in enumerate(panel.pathogens) if bacteria in blist and bacteria != ' Mycoplasma pneumoniae']
+    counts = count_cells(cell_codes, len(cells), df['CaseCount'].to_numpy(dtype=float), panel, candidates)
+    count(rows=len(df), cells=len(cells))
+    return CoinfectionCube(cells, counts, [panel.pathogens[i] for i in candidates])
+
+@timed()
+def build_cooccurrence(df, panel, keys):
+    """Co-occurrence matrices for every combination of the keys, see cooccurrence_cells."""
+    grouped = df.groupby(keys, observed=True, dropna=False)
+    cell_codes = grouped.ngroup().to_numpy()
+    cells = grouped.size().index.to_frame(index=False)
+    matrices, totals = cooccurrence_cells(cell_codes, len(cells), df['CaseCount'].to_numpy(dtype=float), panel)
+    return CooccurrenceCube(cells, matrices, totals, list(panel.pathogens))
+
+def aggregate_cooccurrence(co_cube, group_by, dropna=True):
+    """Sum the co-occurrence cells into the groups of group_by, returns the group keys, matrices and totals."""
+    import scipy.sparse as sp
+    grouped = co_cube.cells.groupby(group_by, observed=True, dropna=dropna)
+    group_codes = grouped.ngroup().to_numpy()
+    group_keys_list = grouped.size().index
+    n_pathogens = len(co_cube.pathogens)
+
+    matrices = [sp.csr_matrix((n_pathogens, n_pathogens)) for _ in range(len(group_keys_list))]
+    totals = np.zeros(len(group_keys_list))
+    for c, g in enumerate(group_codes):
+        if g >= 0:
+            matrices[g] = matrices[g] + co_cube.matrices[c]
+            totals[g] += co_cube.totals[c]
+    return group_keys_list, matrices, totals
+
+def merge_cooccurrence(co_cubes, keys):
+    """Merge partial co-occurrence cubes, aligning the pathogens on their union in order of first appearance."""
+    import scipy.sparse as sp
+    pathogens = list(dict.fromkeys(name for co_cube in co_cubes for name in co_cube.pathogens))
+    position = {name: j for j, name in enumerate(pathogens)}
+    matrices = []
+    for co_cube in co_cubes:
+        n = len(co_cube.pathogens)
+        align = sp.csr_matrix((np.ones(n), (np.arange(n), [position[name] for name in co_cube.pathogens])), shape=(n, len(pathogens)))
+        matrices.extend(sp.csr_matrix(align.T @ matrix @ align) for matrix in co_cube.matrices)
+    cells = pd.concat([co_cube.cells.astype(object) for co_cube in co_cubes], ignore_index=True)
+    totals = np.concatenate([co_cube.totals for co_cube in co_cubes])
+
+    group_keys_list, matrices, totals = aggregate_cooccurrence(CooccurrenceCube(cells, matrices, totals, pathogens), keys, dropna=False)
+    cells = group_keys_list.to_frame(index=False) if isinstance(group_keys_list, pd.MultiIndex) else pd.DataFrame({keys[0]: group_keys_list})
+    return CooccurrenceCube(cells, matrices, totals, pathogens)
+
+def cooccurrence_table(co_cube, groupings):
+    """
+    Long-format co-occurrence of every pair of distinct pathogens (upper triangle without the
+    diagonal, nonzero only) in every stratum.
+
+    Expected counts assume independence within the stratum: n_i * n_j / N, where n_i is the
+    weighted count of pathogen i (the matrix diagonal) and N the stratum's total cases.
+    """
+    import scipy.sparse as sp
+    tables = []
+    pathogens = np.array(co_cube.pathogens, dtype=object)
+    for key, group_by in groupings.items():
+        group_keys_list, matrices, totals = aggregate_cooccurrence(co_cube, group_by)
+        for group_keys, matrix, total in zip(group_keys_list, matrices, totals):
+            if not isinstance(group_keys, tuple):
+                group_keys = (group_keys,)
+            upper = sp.triu(matrix, k=1, format='coo')
+            diagonal = matrix.diagonal()
+            expected = diagonal[upper.row] * diagonal[upper.col] / total if total > 0 else np.zeros(upper.nnz)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratio = np.where(expected > 0, upper.data / expected, np.nan)
+            tables.append(pd.DataFrame({
+                'Grouping': key,
+                'Stratum': '+'.join(str(k) for k in group_keys),
+                'Total Cases': total,
+                'Bacteria 1': pathogens[upper.row],
+                'Bacteria 2': pathogens[upper.col],
+                'Bacteria 1 Cases': diagonal[upper.row],
+                'Bacteria 2 Cases': diagonal[upper.col],
+                'Co-occurrence': upper.data,
+                'Expected': expected,
+                'O/E Ratio': ratio,
+            }))
+    if not tables:
+        return pd.DataFrame(columns=COOCCURRENCE_COLUMNS)
+    return pd.concat(tables, ignore_index=True)
+
+def aggregate_cube(cube, group_by, dropna=True):
+    """Sum the cube cells into the groups of group_by, returns the group keys and the counts."""
+    grouped = cube.cells.groupby(group_by, observed=True, dropna=dropna)
+    group_codes = grouped.ngroup().to_numpy()
+    group_keys_list = grouped.size().index
+    valid = group_codes >= 0
+
+    counts = {}
+    for name, values in cube.counts.items():
+        summed = np.zeros((len(group_keys_list),) + values.shape[1:])
+        np.add.at(summed, group_codes[valid], values[valid])
+        counts[name] = summed
+    return group_keys_list, counts
+
+def merge_cubes(cubes, keys):
+    """
+    Merge partial cubes, e.g. from chunks of the input, into one cube with a single cell per key combination.
+
+    The pathogen columns are aligned on the union of the cubes' pathogens, in order of first appearance.
+    """
+    bacteria = list(dict.fromkeys(name for cube in cubes for name in cube.bacteria))
+    position = {name: j for j, name in enumerate(bacteria)}
+    counts = {}
+    for name in cubes[0].counts:
+        parts = []
+        for cube in cubes:
+            values = cube.counts[name]
+            if values.ndim == 2:
+                aligned = np.zeros((values.shape[0], len(bacteria)))
+                aligned[:, [position[b] for b in cube.bacteria]] = values
+                values = aligned
+            parts.append(values)
+        counts[name] = np.concatenate(parts)
+    cells = pd.concat([cube.cells.astype(object) for cube in cubes], ignore_index=True)
+
+    group_keys_list, counts = aggregate_cube(CoinfectionCube(cells, counts, bacteria), keys, dropna=False)
+    cells = group_keys_list.to_frame(index=False) if isinstance(group_keys_list, pd.MultiIndex) else pd.DataFrame({keys[0]: group_keys_list})
+    return CoinfectionCube(cells, counts, bacteria)
+
+def stream_cube(file_path, chunksize, keys, blist, cooccurrence=False):
+    """
+    Build the cube chunk by chunk, so peak memory is bounded by the chunk size.
+
+    Returns the cube and, if cooccurrence is set, the co-occurrence cube (otherwise None).
+    """
+    cube = co_cube = None
+    for chunk in iter_txt_file(file_path, chunksize, keys):
+        panel = encode_pathogens(chunk['BacteriaList'])
+        chunk_cube = build_cube(chunk, panel, keys, blist)
+        cube = chunk_cube if cube is None else merge_cubes([cube, chunk_cube], keys)
+        if cooccurrence:
+            chunk_co_cube = build_cooccurrence(chunk, panel, keys)
+            co_cube = chunk_co_cube if co_cube is None else merge_cooccurrence([co_cube, chunk_co_cube], keys)
+    return cube, co_cube
+
+def process_grouping(cube, group_by):
+    results = []
+    group_keys_list, counts = aggregate_cube(cube, group_by)
+
+    for g, group_keys in enumerate(group_keys_list):
+        if not isinstance(group_keys, tuple):
+            group_keys = (group_keys,)
+
+        total_cases = counts['total'][g]
+        co_mp_cases = counts['co_mp'][g]
+        s_mp_cases = counts['s_mp'][g]
+        non_mp_cases = total_cases - co_mp_cases - s_mp_cases
+
+        seen = np.flatnonzero(counts['mp_rows'][g] > 0)
+        top_10_bacteria = seen[np.argsort(-counts['mp_count'][g, seen], kind='stable')][:TOP_N]
+
+        for j in top_10_bacteria:
+            bacteria = cube.bacteria[j]
+            mp_count = counts['mp_count'][g, j]
+            nomp_count = counts['nomp_count'][g, j]
+            mp_rate = mp_count / co_mp_cases if co_mp_cases > 0 else 0
+            nomp_rate = nomp_count / non_mp_cases if non_mp_cases > 0 else 0
+            results.append(list(group_keys) + [total_cases, co_mp_cases, s_mp_cases, non_mp_cases, bacteria, mp_count, mp_rate, nomp_rate, nomp_count])
+
+    return results
+
+def parse_groupings(groupings):
+    """{grouping: group columns} of "+"-joined groupings, and the distinct group columns of all of them."""
+    groupings = {key: key.split('+') for key in groupings}
+    for group_by in groupings.values():
+        for column in group_by:
+            if column not in INPUT_COLUMNS or column in ('BacteriaList', 'CaseCount'):
+                raise ValueError(f'Grouping column [{column}] is not in data')
+    keys = list(dict.fromkeys(column for group_by in groupings.values() for column in group_by))
+    return groupings, keys
+
+def grouping_sheets(cube, groupings):
+    """{grouping: results DataFrame} of every grouping of the cube."""
+    sheets = {}
+    for key, group_by in groupings.items():
+        with phase(f'process_grouping {key}'):
+            sheets[key] = pd.DataFrame(process_grouping(cube, group_by), columns=group_by + RESULT_COLUMNS)
+            count(rows=len(sheets[key]))
+    return sheets
+
+def coinfection_statistics(df, blist, groupings=GROUP_COLUMNS):
+    """Co-infection statistics of a prepared input DataFrame, {grouping: results DataFrame}."""
+    groupings, keys = parse_groupings(groupings)
+    cube = build_cube(df, encode_pathogens(df['BacteriaList']), keys, blist)
+    return grouping_sheets(cube, groupings)
@@ -0,0 +1,237 @@
+"""
+AAP, CumAAP and epidemic status of every province and month of normalized cases (02).
+"""
+import pandas as pd
+import numpy as np
+from .table_io import read_table
+from .parallel import run_chunks
+
+# Analysis window, AAP is computed over these months
+WINDOW_START = '2023-04'
+WINDOW_END = '2024-03'
+EPIDEMIC_THRESHOLD = 0.75
+# Epidemic months further apart than this start a new epidemic run
+ONSET_GAP_DAYS = 62
+NORMALIZED_COLUMNS = ['Normalized Cases', 'Normalized MP Cases', 'Normalized Positivity Rate']
+
+def read_and_prepare_data(inputfile):
+    return prepare_data(read_table(inputfile, categories=['prov']))
+
+def prepare_data(df):
+    """Copy of df with parsed dates and their month, df itself is left unchanged."""
+    dates = pd.to_datetime(df['dates'])
+    return df.assign(dates=dates, month=dates.dt.strftime('%Y-%m'))
+
+def build_month_panel(df, months):
+    """
+    Province x month panel in one reindex: one row per province and month of months,
+    months missing from the data get 0 normalized cases and positivity rate.
+
+    :return: long DataFrame sorted by province and month, and the provinces
+    """
+    if df.duplicated(['prov', 'month']).any():
+        raise ValueError("Input must have one row per province and month")
+    provs = np.sort(df['prov'].unique())
+    index = pd.MultiIndex.from_product([provs, months], names=['prov', 'month'])
+    panel = df.set_index(['prov', 'month']).reindex(index)
+    panel[NORMALIZED_COLUMNS] = panel[NORMALIZED_COLUMNS].fillna(0)
+    return panel.reset_index(), provs
+
+def calculate_aap(rates, total_positivity_rate=None):
+    """AAP of every month: positivity rate / the province's total over the window (0 if the total is 0)."""
+    if total_positivity_rate is None:
+        total_positivity_rate = rates.sum(axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total_positivity_rate > 0, rates / total_positivity_rate, 0.0)
+
+def calculate_cum_aap_and_ep(aap, threshold=EPIDEMIC_THRESHOLD):
+    """
+    Cumulative AAP in descending AAP order and the epidemic value of every month.
+
+    Months whose CumAAP stays within the threshold are epidemic (1); the month crossing the
+    threshold gets the fraction of its AAP needed to reach it; all others are 0.
+
+    :param aap: provinces x months array
+    :return: order (months by descending AAP), CumAAP and Epidemic, both in that order
+    """
+    order = np.argsort(-aap, axis=1, kind='stable')
+    sorted_aap = np.take_along_axis(aap, order, axis=1)
+    cum_aap = np.cumsum(sorted_aap, axis=1)
+    previous = np.concatenate([np.full((aap.shape[0], 1), np.nan), cum_aap[:, :-1]], axis=1)
+
+    epidemic = (cum_aap <= threshold).astype(float)
+    crossing = (cum_aap > threshold) & (previous < threshold)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        epidemic[crossing] = np.round((threshold - previous[crossing]) / sorted_aap[crossing], 5)
+    return order, cum_aap, epidemic
+
+def find_onset(epidemic, month_starts, gap_days=ONSET_GAP_DAYS):
+    """
+    Onset month of every province: the first month of its longest run of epidemic months.
+
+    Runs continue across gaps of up to gap_days between epidemic months; the earliest run wins ties.
+
+    :param epidemic: provinces x months boolean array, months in calendar order
+    :param month_starts: first day of every month, or an array of them per row of epidemic
+    :return: provinces x months boolean array marking the onset months
+    """
+    n_provs, n_months = epidemic.shape
+    days = np.broadcast_to(np.asarray(month_starts, dtype='datetime64[D]').astype(np.int64), epidemic.shape)
+    positions = np.where(epidemic, np.arange(n_months), -1)
+    # Last epidemic month before every month
+    last = np.maximum.accumulate(positions, axis=1)
+    previous = np.concatenate([np.full((n_provs, 1), -1), last[:, :-1]], axis=1)
+    previous_days = np.take_along_axis(days, np.maximum(previous, 0), axis=1)
+    new_run = epidemic & ((previous < 0) | (days - previous_days > gap_days))
+
+    run_id = np.cumsum(new_run, axis=1)
+    run_size = np.zeros((n_provs, n_months + 1), dtype=int)
+    rows, columns = np.nonzero(epidemic)
+    np.add.at(run_size, (rows, run_id[rows, columns]), 1)
+    longest = np.argmax(run_size, axis=1)
+    return new_run & (run_id == longest[:, None]) & (run_size.max(axis=1) > 0)[:, None]
+
+def calculate_epidemic(df, window_start=WINDOW_START, window_end=WINDOW_END, threshold=EPIDEMIC_THRESHOLD):
+    """
+    AAP, CumAAP, Epidemic and status of every province and month of the window.
+
+    :return: one row per province and month, sorted by province and descending AAP
+    """
+    month_starts = pd.date_range(start=window_start, end=window_end, freq='MS')
+    months = month_starts.strftime('%Y-%m')
+    panel, provs = build_month_panel(df, months)
+    n_provs, n_months = len(provs), len(months)
+
+    rates = panel['Normalized Positivity Rate'].to_numpy(dtype=float).reshape(n_provs, n_months)
+    order, aap, cum_aap, epidemic, status = epidemic_status(rates, month_starts, threshold)
+
+    rows = (np.arange(n_provs)[:, None] * n_months + order).ravel()
+    out_df = panel.iloc[rows].reset_index(drop=True)
+    out_df['AAP'] = aap.ravel()
+    out_df['CumAAP'] = cum_aap.ravel()
+    out_df['Epidemic'] = epidemic.ravel()
+    out_df['status'] = status.ravel()
+    return out_df[list(df.columns) + ['AAP', 'CumAAP', 'Epidemic', 'status']]
+
+def epidemic_status(rates, month_starts, threshold=EPIDEMIC_THRESHOLD, total_positivity_rate=None):
+    """
+    AAP, CumAAP, Epidemic and status of every row of a windows x months array of positivity rates.
+
+    :return: order (months by descending AAP) and AAP, CumAAP, Epidemic and status, all in that order
+    """
+    aap = calculate_aap(rates, total_positivity_rate)
+    order, cum_aap, epidemic = calculate_cum_aap_and_ep(aap, threshold)
+
+    epidemic_by_month = np.empty_like(epidemic)
+    np.put_along_axis(epidemic_by_month, order, epidemic, axis=1)
+    onset = find_onset(epidemic_by_month != 0, month_starts)
+    status = np.where(onset, 'onset', np.where(epidemic_by_month != 0, 'Epidemic', 'Non-epidemic'))
+    return (order, np.take_along_axis(aap, order, axis=1), cum_aap, epidemic,
+            np.take_along_axis(status, order, axis=1))
+
+def epidemic_summary(order, epidemic, status):
+    """
+    Number of epidemic months and index of the onset month (NaN without epidemic) of every row,
+    from the outputs of epidemic_status.
+    """
+    onset = status == 'onset'
+    first = np.take_along_axis(order, onset.argmax(axis=1)[:, None], axis=1)[:, 0]
+    return (epidemic != 0).sum(axis=1), np.where(onset.any(axis=1), first, np.nan)
+
+def _run_bootstrap(seed_seq, start, n_replicates, cases, p, month_starts, threshold):
+    """Epidemic month counts and onset month indices of one chunk of replicates, as replicates x provinces arrays."""
+    rng = np.random.default_rng(seed_seq)
+    mp_draws = rng.binomial(cases, p, size=(n_replicates,) + cases.shape)
+    rates = mp_draws / np.maximum(cases, 1)
+    order, _, _, epidemic, status = epidemic_status(rates.reshape(-1, rates.shape[-1]), month_starts, threshold)
+    n_months, onset = epidemic_summary(order, epidemic, status)
+    return n_months.reshape(n_replicates, -1), onset.reshape(n_replicates, -1)
+
+def bootstrap_epidemic(df, n_replicates, window_start=WINDOW_START, window_end=WINDOW_END, threshold=EPIDEMIC_THRESHOLD,
+                       ci=0.95, seed=None, workers=1, chunk_size=100):
+    """
+    Percentile CIs of the number of epidemic months and the onset month of every province.
+
+    Normalized MP Cases are redrawn as Binomial(Normalized Cases, Normalized Positivity Rate) for every
+    replicate, province and month at once, and classified like the data. Replicates are drawn in chunks
+    of chunk_size, see run_chunks.
+
+    :return: one row per province with the observed values and their CIs
+    """
+    month_starts = pd.date_range(start=window_start, end=window_end, freq='MS')
+    months = month_starts.strftime('%Y-%m')
+    panel, provs = build_month_panel(df, months)
+    n_provs, n_months = len(provs), len(months)
+    cases = np.round(panel['Normalized Cases'].to_numpy(dtype=float)).astype(np.int64).reshape(n_provs, n_months)
+    rates = panel['Normalized Positivity Rate'].to_numpy(dtype=float).reshape(n_provs, n_months)
+
+    order, _, _, epidemic, status = epidemic_status(rates, month_starts, threshold)
+    observed_months, observed_onset = epidemic_summary(order, epidemic, status)
+
+    args = (cases, np.clip(np.nan_to_num(rates), 0, 1), month_starts.values, threshold)
+    results = run_chunks(_run_bootstrap, n_replicates, chunk_size, seed, workers, args)
+    epidemic_months = np.concatenate([r[0] for r in results])
+    onset = np.concatenate([r[1] for r in results])
+
+    percentiles = [50 * (1 - ci), 50 * (1 + ci)]
+    months_ci = np.percentile(epidemic_months, percentiles, axis=0)
+    with np.errstate(invalid='ignore'):
+        onset_ci = np.nanpercentile(onset, percentiles, axis=0, method='nearest') if onset.size else np.full((2, n_provs), np.nan)
+
+    def month_names(index):
+        return np.where(np.isnan(index), None, months.to_numpy()[np.nan_to_num(index).astype(int)])
+
+    return pd.DataFrame({
+        'prov': provs,
+        'Epidemic Months': observed_months,
+        'Epidemic Months lower': months_ci[0],
+        'Epidemic Months upper': months_ci[1],
+        'Onset Month': month_names(observed_onset),
+        'Onset Month lower': month_names(onset_ci[0]),
+        'Onset Month upper': month_names(onset_ci[1]),
+        'Replicates without onset': np.isnan(onset).sum(axis=0),
+    })
+
+def calculate_sliding_epidemic(df, window_length=12, step=1, start=None, end=None, threshold=EPIDEMIC_THRESHOLD):
+    """
+    Epidemic status of every province in sliding windows of window_length months, one start every step months.
+
+    Window totals of the positivity rate come from prefix sums over the month panel, and all
+    windows of all provinces are classified together.
+
+    :return: long DataFrame, one row per province, window and month, sorted by province,
+             window and descending AAP
+    """
+    start = start or df['month'].min()
+    end = end or df['month'].max()
+    month_starts = pd.date_range(start=start, end=end, freq='MS')
+    months = month_starts.strftime('%Y-%m')
+    panel, provs = build_month_panel(df, months)
+    n_provs, n_months = len(provs), len(months)
+    if window_length > n_months:
+        raise ValueError(f"Window length {window_length} is longer than the {n_months} months from {start} to {end}")
+
+    rates = panel['Normalized Positivity Rate'].to_numpy(dtype=float).reshape(n_provs, n_months)
+    starts = np.arange(0, n_months - window_length + 1, step)
+    n_windows = len(starts)
+    prefix = np.concatenate([np.zeros((n_provs, 1)), np.cumsum(rates, axis=1)], axis=1)
+    totals = (prefix[:, starts + window_length] - prefix[:, starts])[:, :, None]
+
+    # provinces x windows x months views of the panel, without copying
+    windows = np.lib.stride_tricks.sliding_window_view(rates, window_length, axis=1)[:, starts]
+    window_months = np.lib.stride_tricks.sliding_window_view(month_starts.values, window_length)[starts]
+    order, aap, cum_aap, epidemic, status = epidemic_status(
+        windows.reshape(-1, window_length), np.tile(window_months, (n_provs, 1)), threshold, totals.reshape(-1, 1))
+
+    month_index = starts[None, :, None] + order.reshape(n_provs, n_windows, window_length)
+    return pd.DataFrame({
+        'prov': np.repeat(provs, n_windows * window_length),
+        'window_start': np.tile(np.repeat(months[starts], window_length), n_provs),
+        'window_end': np.tile(np.repeat(months[starts + window_length - 1], window_length), n_provs),
+        'month': months.to_numpy()[month_index.ravel()],
+        'Normalized Positivity Rate': np.take_along_axis(rates, month_index.reshape(n_provs, -1), axis=1).ravel(),
+        'AAP': aap.ravel(),
+        'CumAAP': cum_aap.ravel(),
+        'Epidemic': epidemic.ravel(),
+        'status': status.ravel(),
+    })
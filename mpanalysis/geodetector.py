@@ -0,0 +1,460 @@
+
+"""
+Geographic detector (05): factor, interaction and ecological detectors of the q statistic,
+their permutation and bootstrap significance tests, and the optimal discretization of continuous
+factors. scipy is only imported by the factor and ecological detectors.
+"""
+import numpy as np
+import pandas as pd
+from typing import Union, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from .profiling import phase, stop_worker_tracing
+from .parallel import run_chunks
+
+def check_data(df, y, factors):
+    for factor in factors:
+        if not factor in df.columns:
+            raise ValueError(f'Factor [{factor}] is not in data')
+    
+    if y not in df.columns:
+        raise ValueError(f'Factor [{y}] is not in data')
+        
+    for factor in factors:
+        if y == factor:
+            raise ValueError("Y variable should not be in Factor variables.")
+    
+    if df.isnull().values.any():
+        raise ValueError("Data contains NULL values")
+
+def encode_factor(df: pd.DataFrame, factor, extra_factor=None):
+    """Integer-code the strata of a factor (or of a factor pair), returns the codes and the number of strata."""
+    codes, uniques = pd.factorize(df[factor], sort=True)
+    n_strata = len(uniques)
+    if extra_factor is not None and extra_factor != factor:
+        extra_codes, extra_uniques = pd.factorize(df[extra_factor], sort=True)
+        codes, uniques = pd.factorize(codes.astype(np.int64) * len(extra_uniques) + extra_codes, sort=True)
+        n_strata = len(uniques)
+    return codes, n_strata
+
+def strata_ssw(codes, n_strata, y_values):
+    """
+    Within-strata sum of squares and lambda terms from per-stratum sufficient statistics.
+
+    n, sum(y) and sum(y^2) of every stratum come from np.bincount; y is centered first to
+    keep sum(y^2) - sum(y)^2 / n accurate.
+    """
+    y_centered = y_values - y_values.mean()
+    n = np.bincount(codes, minlength=n_strata)
+    s1 = np.bincount(codes, weights=y_centered, minlength=n_strata)
+    s2 = np.bincount(codes, weights=np.square(y_centered), minlength=n_strata)
+    nonempty = n > 0
+    n, s1, s2 = n[nonempty], s1[nonempty], s2[nonempty]
+
+    strataVarSum = np.maximum(s2 - np.square(s1) / n, 0).sum()
+    mean = s1 / n + y_values.mean()
+    lamda_1st_sum = np.square(mean).sum()
+    lamda_2nd_sum = (np.sqrt(n) * mean).sum()
+    return strataVarSum, lamda_1st_sum, lamda_2nd_sum
+
+def cal_ssw(df: pd.DataFrame, y, factor, extra_factor=None):
+    codes, n_strata = encode_factor(df, factor, extra_factor)
+    return strata_ssw(codes, n_strata, df[y].to_numpy(dtype=float))
+
+def cal_q(df, y, factor, extra_factor=None):
+    strataVarSum, lamda_1st_sum, lamda_2nd_sum = cal_ssw(df, y, factor, extra_factor)
+    TotalVar = (df.shape[0]-1) * df[y].var(ddof=1)
+    q = 1 - strataVarSum / TotalVar
+    return q, lamda_1st_sum, lamda_2nd_sum
+
+def pair_codes(codes1, n_strata1, codes2, n_strata2):
+    """Strata codes of the intersection of two integer-coded factors."""
+    codes = codes1.astype(np.int64) * n_strata2 + codes2
+    if n_strata1 * n_strata2 > codes.shape[0]:
+        # Too many possible strata for dense bincounts, keep only the observed ones
+        codes, uniques = pd.factorize(codes)
+        return codes, len(uniques)
+    return codes, n_strata1 * n_strata2
+
+class DetectorContext:
+    """
+    Per-dataset cache shared by the detectors.
+
+    Factors are integer-coded once, and the SSW/lambda terms and q of every factor and
+    factor pair are computed at most once, whichever detector asks first.
+    """
+
+    def __init__(self, df: pd.DataFrame, y: Union[str, int]):
+        self.df = df
+        self.y = y
+        self.y_values = df[y].to_numpy(dtype=float)
+        self.N_popu = df.shape[0]
+        self.N_var = df[y].var(ddof=1)
+        self.TotalVar = (self.N_popu - 1) * self.N_var
+        self._codes = {}
+        self._ssw = {}
+
+    def codes(self, factor, extra_factor=None):
+        """Integer codes and number of strata of a factor or of a factor pair."""
+        if extra_factor is None or extra_factor == factor:
+            if factor not in self._codes:
+                self._codes[factor] = encode_factor(self.df, factor)
+            return self._codes[factor]
+        return pair_codes(*self.codes(factor), *self.codes(extra_factor))
+
+    def ssw(self, factor, extra_factor=None):
+        """Memoized (strataVarSum, lamda_1st_sum, lamda_2nd_sum) of a factor or of a factor pair."""
+        key = frozenset([factor] if extra_factor is None else [factor, extra_factor])
+        if key not in self._ssw:
+            self._ssw[key] = strata_ssw(*self.codes(factor, extra_factor), self.y_values)
+        return self._ssw[key]
+
+    def q(self, factor, extra_factor=None):
+        return 1 - self.ssw(factor, extra_factor)[0] / self.TotalVar
+
+    def n_strata(self, factor):
+        return self.codes(factor)[1]
+
+def get_context(df, y, context=None):
+    if context is None:
+        return DetectorContext(df, y)
+    if context.df is not df or context.y != y:
+        raise ValueError("DetectorContext was built for another dataset")
+    return context
+
+def factor_detector(df: pd.DataFrame, y: Union[str, int], factors: Sequence, context=None):
+    from scipy.stats import ncf
+    check_data(df, y, factors=factors)
+    context = get_context(df, y, context)
+
+    out_df = pd.DataFrame(index=["q statistic", "p value"], columns=factors, dtype="float64")
+    N_var = context.N_var
+    N_popu = context.N_popu
+
+    for factor in factors:
+        N_stra = context.n_strata(factor)
+        _, lamda_1st_sum, lamda_2nd_sum = context.ssw(factor)
+        q = context.q(factor)
+
+        # Lambda value
+        lamda = (lamda_1st_sum - np.square(lamda_2nd_sum) / N_popu) / N_var
+        # F value
+        F_value = (N_popu - N_stra) * q / ((N_stra - 1) * (1 - q))
+        # p value
+        p_value = ncf.sf(F_value, N_stra - 1, N_popu - N_stra, nc=lamda)
+
+        out_df.loc["q statistic", factor] = q
+        out_df.loc["p value", factor] = p_value
+    
+    return out_df
+
+def interaction_relationship(df, context=None):
+    out_values = np.full(df.shape, np.nan, dtype=object)
+    length = len(df.index)
+    q_values = df.to_numpy(dtype=float)
+    if context is None:
+        single_q = np.diag(q_values)
+    else:
+        single_q = [context.q(factor) for factor in df.index]
+
+    for i in range(length):
+        for j in range(i+1, length):
+            i_q = q_values[j, i]
+            q1 = single_q[i]
+            q2 = single_q[j]
+
+            if i_q <= q1 and i_q <= q2:
+                outputRls = "Weaken, nonlinear"
+            elif i_q < max(q1, q2) and i_q > min(q1, q2):
+                outputRls = "Weaken, uni-"
+            elif i_q == (q1 + q2):
+                outputRls = "Independent"
+            elif i_q > max(q1, q2):
+                outputRls = "Enhance, bi-"
+            elif i_q > (q1 + q2):
+                outputRls = "Enhance, nonlinear"
+
+            out_values[j, i] = outputRls
+
+    return pd.DataFrame(out_values, index=df.index, columns=df.columns)
+
+def interaction_detector(df: pd.DataFrame, y: Union[str, int], factors: Sequence, relationship=False, context=None):
+    check_data(df, y, factors=factors)
+    context = get_context(df, y, context)
+
+    length = len(factors)
+    q_values = np.full((length, length), np.nan)
+
+    for i in range(length):
+        for j in range(i + 1):
+            q_values[i, j] = context.q(factors[i], factors[j] if j != i else None)
+    out_df = pd.DataFrame(q_values, index=factors, columns=factors)
+
+    if relationship:
+        out_df2 = interaction_relationship(out_df, context)
+        return out_df, out_df2
+    
+    return out_df
+
+def ecological_detector(df: pd.DataFrame, y: Union[str, int], factors: Sequence, context=None):
+    from scipy.stats import f
+    check_data(df, y, factors=factors)
+    context = get_context(df, y, context)
+    length = len(factors)
+    out_values = np.full((length, length), np.nan, dtype=object)
+    ssw = {factor: context.ssw(factor)[0] for factor in factors}
+
+    for i in range(1, length):
+        ssw1 = ssw[factors[i]]
+        dfn = df[factors[i]].notna().sum() - 1
+        f_critical = f.ppf(0.05, dfn, dfn)
+
+        for j in range(i):
+            ssw2 = ssw[factors[j]]
+            dfd = df[factors[j]].notna().sum() - 1
+            fval = (dfn * (dfd - 1) * ssw1) / (dfd * (dfn - 1) * ssw2)
+
+            if fval < f_critical:
+                out_values[i, j] = 'Y'
+            else:
+                out_values[i, j] = 'N'
+
+    return pd.DataFrame(out_values, index=factors, columns=factors)
+
+def permutation_q(codes, n_strata, y_batch):
+    """
+    q of a stratification for every row of y_batch, a batch of permutations of the centered y.
+
+    The stratum sizes and the total variance do not change under permutation, so only the
+    per-stratum sums are recomputed: q = sum(s1^2 / n) / sum(y^2).
+    """
+    n_reps = y_batch.shape[0]
+    flat = (np.arange(n_reps)[:, None] * n_strata + codes[None, :]).ravel()
+    s1 = np.bincount(flat, weights=y_batch.ravel(), minlength=n_reps * n_strata).reshape(n_reps, n_strata)
+    n = np.bincount(codes, minlength=n_strata)
+    nonempty = n > 0
+    between = (np.square(s1[:, nonempty]) / n[nonempty]).sum(axis=1)
+    return between / np.square(y_batch[0]).sum()
+
+def bootstrap_q(codes, n_strata, y_values, index_batch):
+    """q of a stratification for every row of index_batch, a batch of bootstrap resamples of the rows."""
+    n_reps = index_batch.shape[0]
+    y_batch = y_values[index_batch]
+    y_batch = y_batch - y_batch.mean(axis=1, keepdims=True)
+    flat = (np.arange(n_reps)[:, None] * n_strata + codes[index_batch]).ravel()
+    n = np.bincount(flat, minlength=n_reps * n_strata).reshape(n_reps, n_strata)
+    s1 = np.bincount(flat, weights=y_batch.ravel(), minlength=n_reps * n_strata).reshape(n_reps, n_strata)
+    between = (np.square(s1) / np.maximum(n, 1)).sum(axis=1)
+    return between / np.square(y_batch).sum(axis=1)
+
+def _run_replicates(seed_seq, start, size, targets, y_values, permutations, bootstrap):
+    """Permutation and bootstrap q of all targets for one chunk of replicates."""
+    n_perm, n_boot = (int(np.clip(total - start, 0, size)) for total in (permutations, bootstrap))
+    rng = np.random.default_rng(seed_seq)
+    y_centered = y_values - y_values.mean()
+    perm_q = np.empty((n_perm, len(targets)))
+    boot_q = np.empty((n_boot, len(targets)))
+    if n_perm:
+        y_batch = rng.permuted(np.tile(y_centered, (n_perm, 1)), axis=1)
+        for t, (codes, n_strata) in enumerate(targets):
+            perm_q[:, t] = permutation_q(codes, n_strata, y_batch)
+    if n_boot:
+        index_batch = rng.integers(0, len(y_values), size=(n_boot, len(y_values)))
+        for t, (codes, n_strata) in enumerate(targets):
+            boot_q[:, t] = bootstrap_q(codes, n_strata, y_values, index_batch)
+    return perm_q, boot_q
+
+def significance_tests(df: pd.DataFrame, y: Union[str, int], factors: Sequence, permutations=0, bootstrap=0,
+                       workers=1, seed=None, chunk_size=100, context=None):
+    """
+    Permutation p values and bootstrap percentile CIs of the factor q's and the interaction q's.
+
+    Replicates are drawn in chunks of chunk_size, see run_chunks.
+
+    :return: DataFrame of the single factors and DataFrame of the factor pairs
+    """
+    check_data(df, y, factors=factors)
+    context = get_context(df, y, context)
+    keys = [(factor, None) for factor in factors]
+    keys += [(factors[i], factors[j]) for i in range(len(factors)) for j in range(i)]
+    targets = [context.codes(factor, extra_factor) for factor, extra_factor in keys]
+    observed = np.array([context.q(factor, extra_factor) for factor, extra_factor in keys])
+
+    args = (targets, context.y_values, permutations, bootstrap)
+    results = run_chunks(_run_replicates, max(permutations, bootstrap), chunk_size, seed, workers, args)
+    perm_q = np.concatenate([r[0] for r in results]) if results else np.empty((0, len(keys)))
+    boot_q = np.concatenate([r[1] for r in results]) if results else np.empty((0, len(keys)))
+
+    out_df = pd.DataFrame({
+        'Factor 1': [factor for factor, _ in keys],
+        'Factor 2': [extra_factor for _, extra_factor in keys],
+        'q statistic': observed,
+    })
+    if permutations:
+        # Small tolerance so that ties with the observed q count as exceedances
+        out_df['Permutation p value'] = (1 + (perm_q >= observed - 1e-12).sum(axis=0)) / (permutations + 1)
+    if bootstrap:
+        out_df['Bootstrap CI Lower (0.025)'] = np.percentile(boot_q, 2.5, axis=0)
+        out_df['Bootstrap CI Upper (0.975)'] = np.percentile(boot_q, 97.5, axis=0)
+
+    single = out_df['Factor 2'].isna()
+    df_single = out_df[single].drop(columns='Factor 2').rename(columns={'Factor 1': 'Factor'}).set_index('Factor')
+    df_pairs = out_df[~single].reset_index(drop=True)
+    return df_single, df_pairs
+
+DISCRETIZATION_METHODS = ['equal', 'quantile', 'natural', 'geometric']
+# Shift of the rescaled values of the geometric classes of factors that are not all positive
+GEOMETRIC_OFFSET = 0.1
+# Report sheets written without their index
+UNINDEXED_SHEETS = ('Discretization', 'Interaction Significance')
+
+def natural_breaks(values, max_classes, max_points=1000):
+    """
+    Jenks natural breaks cut points for 2..max_classes classes by Fisher's exact dynamic programming.
+
+    Larger inputs are first reduced to max_points evenly spaced quantiles.
+
+    :return: dict {number of classes: sorted cut points}
+    """
+    points = np.sort(values)
+    if points.shape[0] > max_points:
+        points = np.quantile(points, np.linspace(0, 1, max_points))
+    n = points.shape[0]
+    s1 = np.concatenate([[0], np.cumsum(points)])
+    s2 = np.concatenate([[0], np.cumsum(np.square(points))])
+    start, end = np.meshgrid(np.arange(n), np.arange(n), indexing='ij')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # cost[i, j]: sum of squared deviations of points[i..j]
+        cost = s2[end + 1] - s2[start] - np.square(s1[end + 1] - s1[start]) / (end - start + 1)
+    cost[start > end] = np.inf
+
+    best = cost[0]
+    back = []
+    cuts = {}
+    for n_classes in range(2, max_classes + 1):
+        # Last class starts at i >= 1, the previous classes cover points[0..i-1]
+        total = best[:-1, None] + cost[1:]
+        back.append(np.argmin(total, axis=0) + 1)
+        best = np.min(total, axis=0)
+
+        class_cuts = []
+        j = n - 1
+        for starts in reversed(back):
+            i = starts[j]
+            class_cuts.append(points[i])
+            j = i - 1
+        cuts[n_classes] = np.array(sorted(class_cuts))
+    return cuts
+
+def class_cuts(values, method, n_classes):
+    """
+    Inner cut points of n_classes classes of values by the given method.
+
+    The geometric classes grow by a constant ratio from the minimum to the maximum when all values are
+    positive. Otherwise the progression runs over the values rescaled to [0, 1] and shifted by
+    GEOMETRIC_OFFSET, and is mapped back. Either way the classes do not change when the factor is
+    multiplied by a positive constant, e.g. for a change of units.
+    """
+    low, high = values.min(), values.max()
+    if method == 'equal':
+        return np.linspace(low, high, n_classes + 1)[1:-1]
+    elif method == 'quantile':
+        return np.quantile(values, np.linspace(0, 1, n_classes + 1)[1:-1])
+    elif method == 'natural':
+        return natural_breaks(values, n_classes)[n_classes] if n_classes > 1 else np.array([])
+    elif method == 'geometric':
+        if low > 0:
+            return np.geomspace(low, high, n_classes + 1)[1:-1]
+        scaled = np.geomspace(GEOMETRIC_OFFSET, 1 + GEOMETRIC_OFFSET, n_classes + 1)[1:-1] - GEOMETRIC_OFFSET
+        return low + scaled * (high - low)
+    raise ValueError(f'Unknown discretization method [{method}]')
+
+def discretize(values, method, n_classes, cuts=None):
+    """Integer codes of values in n_classes classes by the given method, classes are left-closed."""
+    values = np.asarray(values, dtype=float)
+    if cuts is None:
+        cuts = class_cuts(values, method, n_classes)
+    return np.searchsorted(np.unique(cuts), values, side='right')
+
+def _search_discretization(task):
+    """q of every class count of one factor and one method."""
+    y_values, factor, values, method, classes = task
+    TotalVar = np.square(y_values - y_values.mean()).sum()
+    # One dynamic programming pass gives the natural breaks of every class count
+    natural_cuts = natural_breaks(values, max(classes)) if method == 'natural' else {}
+    rows = []
+    for n_classes in classes:
+        codes = discretize(values, method, n_classes, natural_cuts.get(n_classes))
+        strataVarSum, _, _ = strata_ssw(codes, n_classes, y_values)
+        rows.append((factor, method, n_classes, len(np.unique(codes)), 1 - strataVarSum / TotalVar))
+    return rows
+
+def optimal_discretization(df: pd.DataFrame, y: Union[str, int], factors: Sequence, methods=DISCRETIZATION_METHODS,
+                           classes=range(3, 11), workers=1):
+    """
+    Discretize continuous factors with the method and class count that maximize q.
+
+    Every (factor, method) grid row is evaluated in a process pool when workers > 1.
+
+    :return: copy of df with the factors replaced by their class codes, and the searched grid
+    """
+    check_data(df, y, factors=factors)
+    y_values = df[y].to_numpy(dtype=float)
+    tasks = [(y_values, factor, df[factor].to_numpy(dtype=float), method, list(classes)) for factor in factors for method in methods]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=stop_worker_tracing) as executor:
+            results = list(executor.map(_search_discretization, tasks))
+    else:
+        results = [_search_discretization(task) for task in tasks]
+    grid = pd.DataFrame([row for rows in results for row in rows], columns=['Factor', 'Method', 'Classes', 'Strata', 'q statistic'])
+
+    # Best q per factor, the first candidate in grid order wins ties
+    best = grid.loc[grid.groupby('Factor', sort=False)['q statistic'].idxmax()]
+    grid['Selected'] = grid.index.isin(best.index)
+    out_df = df.copy()
+    for _, row in best.iterrows():
+        out_df[row['Factor']] = discretize(df[row['Factor']].to_numpy(dtype=float), row['Method'], row['Classes'])
+    return out_df, grid
+
+def geodetector_report(df: pd.DataFrame, permutations=0, bootstrap=0, workers=1, seed=None, discretize=(),
+                       methods=DISCRETIZATION_METHODS, classes=range(3, 11)):
+    """
+    All detectors on df, whose first column is y and the remaining columns the factors.
+
+    :return: {sheet name: DataFrame}, the sheets not in UNINDEXED_SHEETS keep their index
+    """
+    columns = df.columns
+
+    # Set parameters for factor detection
+    target_column = columns[0]  # First column as y value
+    factor_columns = columns[1:]  # Remaining columns as factor variables
+
+    # Discretize continuous factors
+    if discretize:
+        with phase('discretization', factors=len(discretize)):
+            df, df_grid = optimal_discretization(df, target_column, discretize, methods, classes, workers)
+
+    # Share the per-factor and per-pair statistics between the detectors
+    context = DetectorContext(df, target_column)
+
+    # Perform factor detection
+    with phase('factor_detector', rows=len(df), factors=len(factor_columns)):
+        df_fd = factor_detector(df, target_column, factor_columns, context=context)
+
+    # Perform interaction detection
+    with phase('interaction_detector', pairs=len(factor_columns) * (len(factor_columns) - 1) // 2):
+        df1, df2 = interaction_detector(df, target_column, factor_columns, relationship=True, context=context)
+
+    # Perform ecological detection
+    with phase('ecological_detector'):
+        df_ed = ecological_detector(df, target_column, factor_columns, context=context)
+
+    sheets = {'Factor Detection': df_fd, 'Interaction Detection 1': df1, 'Interaction Detection 2': df2, 'Ecological Detection': df_ed}
+    if discretize:
+        sheets['Discretization'] = df_grid
+
+    # Perform permutation and bootstrap significance tests
+    if permutations or bootstrap:
+        with phase('significance_tests', permutations=permutations, bootstrap=bootstrap):
+            sheets['Factor Significance'], sheets['Interaction Significance'] = significance_tests(
+                df, target_column, factor_columns, permutations, bootstrap, workers, seed, context=context)
+    return sheets
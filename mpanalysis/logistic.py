@@ -0,0 +1,283 @@
+"""
+Per-pathogen logistic regression of MP on the covariates (06), and the score-test screening of
+pathogen pair interactions. statsmodels and scipy are only imported when a model is fitted.
+"""
+import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from .table_io import read_table
+from .profiling import phase, count, stop_worker_tracing
+
+Y_NAME = 'Mycoplasma pneumoniae'
+COVARIATES = ['region', 'site', 'age', 'sex']
+RESULT_COLUMNS = ['Bacteria', 'Coefficient', 'P-value', 'Std Err', 'Z', 'CI Lower (0.025)', 'CI Upper (0.975)']
+INTERACTION_COLUMNS = ['Bacteria 1', 'Bacteria 2', 'Score Chi2', 'Score P-value', 'Coefficient', 'P-value', 'Std Err', 'Z',
+                       'CI Lower (0.025)', 'CI Upper (0.975)', 'FDR']
+
+def read_data(file_path):
+    """Reads data from a file with different formats: CSV, TXT (tab separated), Parquet, Excel"""
+    return read_table(file_path)
+
+def compress_rows(y, X):
+    """
+    Collapse identical (y, X) rows into unique patterns.
+
+    :return: y and X of the unique patterns, and the number of rows of each pattern
+    """
+    patterns = X.assign(_y=y.values).value_counts(sort=False, dropna=False).reset_index(name='_count')
+    return patterns['_y'], patterns[list(X.columns)], patterns['_count']
+
+def fit_model(y, X, compress=False, start_params=None):
+    """
+    Fit the logistic regression of y on X (with a constant).
+
+    With compress, identical rows are collapsed first and a frequency-weighted Binomial GLM
+    is fitted, which gives the same coefficients, standard errors and CIs as Logit on all rows.
+    The GLM is fitted by Newton with Logit's iteration limit rather than IRLS, whose deviance
+    criterion declares convergence under separation, so both report mle_retvals['converged'] alike.
+    start_params (constant first) warm-starts the Newton iterations.
+    """
+    import statsmodels.api as sm
+    if compress:
+        y, X, counts = compress_rows(y, X)
+        return sm.GLM(y, sm.add_constant(X), family=sm.families.Binomial(), freq_weights=counts).fit(
+            start_params=start_params, method='newton', maxiter=35, disp=0)
+    return sm.Logit(y, sm.add_constant(X)).fit(start_params=start_params, disp=start_params is None)
+
+def fit_bacteria(matrix, columns, bacteria, compress=False):
+    """
+    Fit the model of one bacteria on the numeric data matrix.
+
+    :param matrix: 2-D float array, one column per name in columns
+    :param columns: column names of matrix, including Y_NAME, the covariates and bacteria
+    :param bacteria: name of the bacteria variable
+    :return: (result dict, None) or (None, error message)
+    """
+    try:
+        position = {name: i for i, name in enumerate(columns)}
+        names = COVARIATES + [bacteria]
+        X = pd.DataFrame(matrix[:, [position[name] for name in names]], columns=names)
+        y = pd.Series(matrix[:, position[Y_NAME]], name=Y_NAME)
+
+        # Fit model only if it converges
+        model = fit_model(y, X, compress)
+        if not model.mle_retvals['converged']:
+            return None, 'model did not converge'
+
+        # Extract coefficients and p-values
+        ci_lower, ci_upper = model.conf_int().loc[bacteria]
+        return {
+            'Bacteria': bacteria,
+            'Coefficient': model.params[bacteria],
+            'P-value': model.pvalues[bacteria],
+            'Std Err': model.bse[bacteria],
+            'Z': model.tvalues[bacteria],
+            'CI Lower (0.025)': ci_lower,
+            'CI Upper (0.975)': ci_upper
+        }, None
+    except Exception as e:
+        return None, str(e)
+
+def fit_pair(matrix, columns, bacteria1, bacteria2, bacteria_vars, start_params=None, compress=False):
+    """
+    Fit the main-effects model of the screen (covariates and all of bacteria_vars) with the interaction
+    of two bacteria added, warm-started from start_params.
+
+    :return: (result dict of the interaction term, None) or (None, error message)
+    """
+    try:
+        position = {name: i for i, name in enumerate(columns)}
+        names = COVARIATES + list(bacteria_vars)
+        X = pd.DataFrame(matrix[:, [position[name] for name in names]], columns=names)
+        X['Interaction'] = X[bacteria1] * X[bacteria2]
+        y = pd.Series(matrix[:, position[Y_NAME]], name=Y_NAME)
+
+        model = fit_model(y, X, compress, start_params)
+        if not model.mle_retvals['converged']:
+            return None, 'model did not converge'
+
+        ci_lower, ci_upper = model.conf_int().loc['Interaction']
+        return {
+            'Coefficient': model.params['Interaction'],
+            'P-value': model.pvalues['Interaction'],
+            'Std Err': model.bse['Interaction'],
+            'Z': model.tvalues['Interaction'],
+            'CI Lower (0.025)': ci_lower,
+            'CI Upper (0.975)': ci_upper
+        }, None
+    except Exception as e:
+        return None, str(e)
+
+def independent_columns(A, tol=1e-10):
+    """
+    Columns of A that are not constant zero or a linear combination of the columns before them.
+
+    :return: boolean mask of the columns of A
+    """
+    norms = np.linalg.norm(A, axis=0)
+    R = np.linalg.qr(A / np.where(norms > 0, norms, 1), mode='r')
+    return (norms > 0) & (np.abs(np.diag(R)) > tol)
+
+def score_test_pairs(X, y, P, base_params):
+    """
+    Score tests of adding the interaction p_i * p_j to the main-effects model, for all pairs at once.
+
+    The null model has the covariates and the main effects of all pathogens, so both main effects of
+    every pair are in it and the 1 df test is on the interaction alone. Every pair's score and
+    nuisance-adjusted information come from a few pathogen x pathogen products, so no model is fitted.
+
+    :param X: covariate matrix with the constant first, n x q
+    :param y: response, n
+    :param P: binary pathogen matrix, n x m
+    :param base_params: coefficients of the main-effects model, of the columns of X then P
+    :return: pair indices (i, j), chi-square statistics (1 df) and p values, NaN for pairs never seen together
+    """
+    from scipy.stats import chi2
+    X = np.hstack([X, P])
+    mu = 1 / (1 + np.exp(-X @ base_params))
+    w = mu * (1 - mu)
+    r = y - mu
+
+    A_inv = np.linalg.pinv(X.T @ (w[:, None] * X))
+    # Pathogens are binary, so z = p_i * p_j has z^T r = (P^T diag(r) P)_ij and z^T W z = (P^T W P)_ij
+    U = P.T @ (r[:, None] * P)
+    D = P.T @ (w[:, None] * P)
+    T = np.stack([P.T @ ((w * X[:, k])[:, None] * P) for k in range(X.shape[1])], axis=-1)
+
+    i, j = np.triu_indices(P.shape[1], k=1)
+    ZWX = T[i, j]
+    information = D[i, j] - np.einsum('pa,ab,pb->p', ZWX, A_inv, ZWX)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        statistic = np.where(information > 1e-10, np.square(U[i, j]) / information, np.nan)
+    return i, j, statistic, chi2.sf(statistic, 1)
+
+_shared = {}
+
+def _attach_shared(name, shape, columns):
+    stop_worker_tracing()
+    # Keep a reference to the block, the array is only a view on its buffer
+    shm = SharedMemory(name=name)
+    _shared.update(shm=shm, matrix=np.ndarray(shape, dtype=np.float64, buffer=shm.buf), columns=columns)
+
+def _run_shared(task):
+    func, args = task
+    return func(_shared['matrix'], _shared['columns'], *args)
+
+def map_shared(matrix, columns, func, tasks, workers=1):
+    """
+    Call func(matrix, columns, *args) for every args in tasks, in a process pool if workers > 1.
+
+    The workers read the matrix from one shared memory block instead of a pickled copy per task.
+    Results come back in the order of tasks.
+    """
+    if workers <= 1:
+        return [func(matrix, columns, *args) for args in tasks]
+
+    shm = SharedMemory(create=True, size=max(matrix.nbytes, 1))
+    try:
+        np.ndarray(matrix.shape, dtype=np.float64, buffer=shm.buf)[:] = matrix
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_shared,
+                                 initargs=(shm.name, matrix.shape, columns)) as executor:
+            return list(executor.map(_run_shared, [(func, args) for args in tasks]))
+    finally:
+        shm.close()
+        shm.unlink()
+
+def fit_all(sample_data, bacteria_vars, compress=False, workers=1):
+    """
+    Fit the model of every bacteria, see map_shared.
+
+    :return: list of (bacteria, result dict or None, error message or None), in the order of bacteria_vars
+    """
+    columns = [Y_NAME] + COVARIATES + list(bacteria_vars)
+    matrix = sample_data[columns].to_numpy(dtype=np.float64)
+    results = map_shared(matrix, columns, fit_bacteria, [(bacteria, compress) for bacteria in bacteria_vars], workers)
+    return [(bacteria, *result) for bacteria, result in zip(bacteria_vars, results)]
+
+def screen_interactions(sample_data, bacteria_vars, alpha=0.05, compress=False, workers=1):
+    """
+    Screen all pathogen pairs for an interaction with MP.
+
+    The main-effects model (covariates and all pathogens) is fitted once, after dropping the pathogens
+    that are constant or aliased with the columns before them. A 1 df score test of every interaction
+    at its estimates pre-filters the pairs, see score_test_pairs, and only pairs with a score p value
+    <= alpha get a full Newton fit of the same model with the interaction added, warm-started from the
+    main-effects coefficients. FDR is the Benjamini-Hochberg adjustment of the interaction p values
+    over all pairs, so the selection by the screen does not shrink the number of tests.
+
+    :return: DataFrame with one row per pair of the kept pathogens, and the list of (names, error message)
+             failures: names is the pair for a failed fit, the pathogen for a dropped one, and () for the
+             main-effects model
+    """
+    import statsmodels.api as sm
+    from statsmodels.stats.multitest import multipletests
+    X = sm.add_constant(sample_data[COVARIATES].astype(float)).to_numpy()
+    P = sample_data[list(bacteria_vars)].to_numpy(dtype=np.float64)
+    failures = []
+    kept = independent_columns(np.hstack([X, P]))[X.shape[1]:]
+    for bacteria in np.array(bacteria_vars, dtype=object)[~kept]:
+        failures.append(((bacteria,), 'constant or aliased with other columns, left out of the screen'))
+    bacteria_vars = [bacteria for bacteria, keep in zip(bacteria_vars, kept) if keep]
+
+    columns = [Y_NAME] + COVARIATES + bacteria_vars
+    matrix = sample_data[columns].to_numpy(dtype=np.float64)
+    y = matrix[:, 0]
+    P = matrix[:, 1 + len(COVARIATES):]
+    i, j = np.triu_indices(len(bacteria_vars), k=1)
+    out_df = pd.DataFrame({
+        'Bacteria 1': np.array(bacteria_vars, dtype=object)[i],
+        'Bacteria 2': np.array(bacteria_vars, dtype=object)[j],
+    }).reindex(columns=INTERACTION_COLUMNS)
+    try:
+        base = sm.Logit(y, np.hstack([X, P])).fit(disp=0)
+        if not base.mle_retvals['converged']:
+            failures.append(((), 'main-effects model did not converge'))
+            return out_df, failures
+    except Exception as e:
+        failures.append(((), str(e)))
+        return out_df, failures
+
+    i, j, statistic, score_p = score_test_pairs(X, y, P, base.params)
+    out_df['Score Chi2'] = statistic
+    out_df['Score P-value'] = score_p
+
+    selected = np.flatnonzero(score_p <= alpha)
+    start_params = np.append(base.params, 0)
+    tasks = [(bacteria_vars[i[p]], bacteria_vars[j[p]], bacteria_vars, start_params, compress) for p in selected]
+    for p, (result, error) in zip(selected, map_shared(matrix, columns, fit_pair, tasks, workers)):
+        if error is not None:
+            failures.append(((bacteria_vars[i[p]], bacteria_vars[j[p]]), error))
+        else:
+            for name, value in result.items():
+                out_df.loc[p, name] = value
+
+    # Benjamini-Hochberg over all tested pairs, the pairs without a fit (screened out or failed) count with p = 1
+    fitted = out_df['P-value'].notna()
+    if fitted.any():
+        p_values = out_df['P-value'].astype(float).fillna(1).to_numpy()
+        out_df.loc[fitted, 'FDR'] = multipletests(p_values, method='fdr_bh')[1][fitted.to_numpy()]
+    return out_df, failures
+
+def sample_bacteria(data, sample_fraction):
+    """Pathogen columns (all but the covariates, the dependent variable and date) and the sampled rows."""
+    bacteria_vars = [col for col in data.columns if col not in COVARIATES + [Y_NAME] + ['date']]
+    # Randomly sample data for analysis based on specified fraction
+    return bacteria_vars, data.sample(frac=sample_fraction, random_state=1)
+
+def logistic_regression(sample_data, bacteria_vars, compress=False, workers=1):
+    """
+    Fit each bacteria variable, failures do not stop the batch.
+
+    :return: DataFrame with one row per fitted bacteria, and the list of (bacteria, error message) failures
+    """
+    rows = []
+    failures = []
+    with phase('fit_models', rows=len(sample_data), models=len(bacteria_vars)):
+        for bacteria, result, error in fit_all(sample_data, bacteria_vars, compress, workers):
+            if error is not None:
+                failures.append((bacteria, error))
+            else:
+                rows.append(result)
+        count(failed=len(failures))
+    return pd.DataFrame(rows, columns=RESULT_COLUMNS), failures
@@ -0,0 +1,299 @@
+"""
+Centered rolling averages of the daily positivity rate and N50 days (03), with their bootstrap CIs
+and the state of the incremental daily refresh.
+"""
+import warnings
+import pandas as pd
+import numpy as np
+from .table_io import read_table, table_format
+from .profiling import phase, timed, count
+from .parallel import run_chunks
+
+ROLLING_WINDOW = 7
+OUTPUT_COLUMNS = ['prov', 'days', 'Day_Cases', 'Day_MP_Cases', 'Average_Day_Cases', 'Average_Day_MP_Cases', 'Average_Day_Positivity_Rate']
+
+def read_and_prepare_data(inputfile):
+    return prepare_data(read_table(inputfile))
+
+def read_days_after(inputfile, last_day):
+    """
+    Prepared rows of inputfile after last_day.
+
+    Parquet inputs whose days column is a date or timestamp are filtered while reading, so only the
+    new days are loaded; other inputs are parsed in full and then filtered.
+    """
+    options = {}
+    if table_format(inputfile)[0] == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        days_type = pq.read_schema(inputfile).field('days').type
+        if pa.types.is_timestamp(days_type):
+            options['filters'] = [('days', '>', pd.Timestamp(last_day))]
+        elif pa.types.is_date(days_type):
+            options['filters'] = [('days', '>', pd.Timestamp(last_day).date())]
+    df = prepare_data(read_table(inputfile, **options))
+    return df[df['days'] > pd.Timestamp(last_day)]
+
+def prepare_data(df):
+    """Copy of df with parsed days, df itself is left unchanged."""
+    return df.assign(days=pd.to_datetime(df['days']))
+
+@timed()
+def fill_missing_dates(df, full_date_range):
+    """
+    Province x day grid in one reindex, days missing from the data get 0 cases.
+
+    Rows of the same province and day are summed first.
+
+    :return: long DataFrame sorted by province and day, and the provinces
+    """
+    counts = df.groupby(['prov', 'days'])[['Day_Cases', 'Day_MP_Cases']].sum()
+    provs = counts.index.get_level_values('prov').unique().sort_values()
+    count(rows=len(df), provinces=len(provs), days=len(full_date_range))
+    index = pd.MultiIndex.from_product([provs, full_date_range], names=['prov', 'days'])
+    return counts.reindex(index, fill_value=0).reset_index(), provs
+
+def centered_rolling_mean(values, window=ROLLING_WINDOW):
+    """
+    Centered rolling mean along the days (last axis) of a provinces x days array, with min_periods=1.
+
+    Every window sum is a difference of the row-wise cumulative sums.
+    """
+    n_days = values.shape[-1]
+    cumulative = np.concatenate([np.zeros(values.shape[:-1] + (1,)), np.cumsum(values, axis=-1)], axis=-1)
+    # Same window bounds as rolling(window, center=True): (window - 1) // 2 days after, the rest before
+    after = (window - 1) // 2
+    before = window - 1 - after
+    positions = np.arange(n_days)
+    low = np.maximum(positions - before, 0)
+    high = np.minimum(positions + after + 1, n_days)
+    return (cumulative[..., high] - cumulative[..., low]) / (high - low)
+
+def positivity_rate(avg_mp_cases, avg_cases):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return avg_mp_cases / avg_cases
+
+@timed()
+def calculate_rolling_averages(grid, n_provs, n_days):
+    day_cases = grid['Day_Cases'].to_numpy(dtype=float).reshape(n_provs, n_days)
+    day_mp_cases = grid['Day_MP_Cases'].to_numpy(dtype=float).reshape(n_provs, n_days)
+    grid['Average_Day_Cases'] = centered_rolling_mean(day_cases).astype(int).ravel()
+    grid['Average_Day_MP_Cases'] = centered_rolling_mean(day_mp_cases).astype(int).ravel()
+    grid['Average_Day_Positivity_Rate'] = positivity_rate(grid['Average_Day_MP_Cases'], grid['Average_Day_Cases'])
+    return grid
+
+def calculate_n50_days(rates):
+    """
+    N50 days of every row of a provinces x days array of positivity rates: the number of
+    highest-rate days whose cumulative rate stays within half of the total (NaN days are skipped).
+    Leading axes, e.g. bootstrap replicates, are kept.
+    """
+    sorted_rates = -np.sort(-rates, axis=-1)
+    total_positivity_rate = np.nansum(rates, axis=-1)
+    cumulative_sum = np.cumsum(sorted_rates, axis=-1)
+    return (cumulative_sum <= total_positivity_rate[..., None] / 2).sum(axis=-1)
+
+def _run_bootstrap(seed_seq, start, n_replicates, day_cases, p, fixed_mp_cases):
+    """N50 days of one chunk of replicates, as a replicates x provinces array."""
+    rng = np.random.default_rng(seed_seq)
+    mp_draws = rng.binomial(day_cases, p, size=(n_replicates,) + day_cases.shape) + fixed_mp_cases
+    avg_cases = centered_rolling_mean(day_cases).astype(int)
+    avg_mp_cases = centered_rolling_mean(mp_draws).astype(int)
+    return calculate_n50_days(positivity_rate(avg_mp_cases, avg_cases))
+
+def bootstrap_n50_days(day_cases, day_mp_cases, n_replicates, seed=None, workers=1, chunk_size=100):
+    """
+    Bootstrap replicates of the N50 days: Day_MP_Cases is redrawn as Binomial(Day_Cases, MP rate)
+    for every replicate, province and day at once, then averaged and reduced like the data.
+    Days with more MP cases than cases cannot be redrawn, they keep their observed MP cases in every
+    replicate (with a warning), so the replicates reduce the same rates as the N50 days of the data.
+
+    Replicates are drawn in chunks of chunk_size, see run_chunks.
+
+    :param day_cases: provinces x days array of cases
+    :param day_mp_cases: provinces x days array of MP cases
+    :return: replicates x provinces array of N50 days
+    """
+    fixed = day_mp_cases > day_cases
+    if fixed.any():
+        warnings.warn(f"{fixed.sum()} province days have more MP cases than cases, "
+                      "their MP cases are kept as observed in the bootstrap replicates")
+    p = np.where(fixed, 0, np.clip(np.nan_to_num(positivity_rate(day_mp_cases, day_cases)), 0, 1))
+    args = (day_cases.astype(np.int64), p, np.where(fixed, day_mp_cases, 0).astype(np.int64))
+    results = run_chunks(_run_bootstrap, n_replicates, chunk_size, seed, workers, args)
+    return np.concatenate(results) if results else np.empty((0, day_cases.shape[0]), dtype=int)
+
+@timed()
+def add_n50_ci(n50_df, day_cases, day_mp_cases, n_replicates, ci=0.95, seed=None, workers=1, chunk_size=100):
+    """Add percentile CI columns N50Days_lower and N50Days_upper from n_replicates bootstrap replicates."""
+    replicates = bootstrap_n50_days(day_cases, day_mp_cases, n_replicates, seed, workers, chunk_size)
+    n50_df['N50Days_lower'], n50_df['N50Days_upper'] = np.percentile(replicates, [50 * (1 - ci), 50 * (1 + ci)], axis=0)
+    return n50_df
+
+def rolling_window_after(window=ROLLING_WINDOW):
+    """Number of later days inside a centered window, i.e. how many earlier means a new day changes."""
+    return (window - 1) // 2
+
+def n50_from_sorted(sorted_rates, rates):
+    """
+    N50 days from rates sorted in ascending order with NaN last, one row per province.
+
+    The valid rates are reversed into descending order and reduced like calculate_n50_days, with the
+    total summed over rates in day order, so the result is the same as a full run to the last bit.
+    """
+    n_valid = (~np.isnan(sorted_rates)).sum(axis=1)
+    k = np.arange(sorted_rates.shape[1])
+    descending = np.take_along_axis(sorted_rates, np.clip(n_valid[:, None] - 1 - k, 0, None), axis=1)
+    descending[k >= n_valid[:, None]] = np.nan
+    total_positivity_rate = np.nansum(rates, axis=-1)
+    return (np.cumsum(descending, axis=-1) <= total_positivity_rate[..., None] / 2).sum(axis=-1)
+
+def state_n50_days(state):
+    """N50 days of every province of an incremental state."""
+    return n50_from_sorted(state['sorted_rates'], positivity_rate(state['avg_mp_cases'], state['avg_cases']))
+
+def build_state(grid, provs, full_date_range):
+    """Arrays kept between incremental runs: daily counts, their centered means and the sorted rates."""
+    n_provs, n_days = len(provs), len(full_date_range)
+    avg_cases = grid['Average_Day_Cases'].to_numpy().reshape(n_provs, n_days)
+    avg_mp_cases = grid['Average_Day_MP_Cases'].to_numpy().reshape(n_provs, n_days)
+    return {
+        'provs': np.asarray(provs),
+        'first_day': np.datetime64(full_date_range[0], 'D'),
+        'day_cases': grid['Day_Cases'].to_numpy(dtype=float).reshape(n_provs, n_days),
+        'day_mp_cases': grid['Day_MP_Cases'].to_numpy(dtype=float).reshape(n_provs, n_days),
+        'avg_cases': avg_cases,
+        'avg_mp_cases': avg_mp_cases,
+        'sorted_rates': np.sort(positivity_rate(avg_mp_cases, avg_cases), axis=1),
+    }
+
+def new_state(df):
+    """State of a prepared province x day table, the start of the incremental runs."""
+    full_date_range = pd.date_range(start=df['days'].min(), end=df['days'].max())
+    grid, provs = fill_missing_dates(df, full_date_range)
+    grid = calculate_rolling_averages(grid, len(provs), len(full_date_range))
+    return build_state(grid, provs, full_date_range)
+
+def save_state(path, state):
+    """
+    Save the state without pickling: text province names are stored as a fixed-width unicode array.
+
+    The file is written to path as given, np.savez would append .npz to a bare path. It is not
+    compressed, so a daily save costs a plain write of the arrays instead of recompressing all days.
+    """
+    state = dict(state)
+    state['provs_are_text'] = np.array(state['provs'].dtype.kind in 'OUT')
+    if state['provs_are_text']:
+        state['provs'] = np.asarray(state['provs'], dtype=str)
+    with open(path, 'wb') as f:
+        np.savez(f, **state)
+
+def state_last_day(state):
+    """Last day covered by a state."""
+    return state['first_day'] + np.timedelta64(state['day_cases'].shape[1] - 1, 'D')
+
+def load_state(path):
+    with np.load(path, allow_pickle=False) as data:
+        state = {key: data[key] for key in data.files}
+    # Text names come back as objects, like the names read from the input
+    if state.pop('provs_are_text', False):
+        state['provs'] = state['provs'].astype(object)
+    return state
+
+@timed()
+def update_state(state, df):
+    """
+    Append the days of df after the last day of the state.
+
+    Only the centered means of the new days and of the last days whose window reaches them are
+    recomputed, and their rates are swapped in the sorted rates by binary search.
+
+    :return: updated state and the index of the first recomputed day
+    """
+    n_days = state['day_cases'].shape[1]
+    last_day = state_last_day(state)
+    days = df['days'].to_numpy().astype('datetime64[D]')
+    if (days <= last_day).any():
+        warnings.warn(f"Ignoring {(days <= last_day).sum()} rows on or before the last day of the state ({last_day})")
+    df = df[days > last_day]
+    if df.empty:
+        return state, n_days
+
+    # New provinces start with an empty history
+    provs = np.union1d(state['provs'], df['prov'].unique())
+    rows = np.searchsorted(provs, state['provs'])
+    new_days = pd.date_range(start=pd.Timestamp(last_day.item()) + pd.Timedelta(days=1), end=df['days'].max())
+    grid, _ = fill_missing_dates(df, new_days)
+    grid = grid.set_index(['prov', 'days']).reindex(pd.MultiIndex.from_product([provs, new_days]), fill_value=0)
+
+    total_days = n_days + len(new_days)
+    updated = {'provs': provs, 'first_day': state['first_day']}
+    for key in ['day_cases', 'day_mp_cases', 'avg_cases', 'avg_mp_cases']:
+        values = np.zeros((len(provs), total_days), dtype=state[key].dtype)
+        values[rows, :n_days] = state[key]
+        updated[key] = values
+    updated['day_cases'][:, n_days:] = grid['Day_Cases'].to_numpy(dtype=float).reshape(len(provs), -1)
+    updated['day_mp_cases'][:, n_days:] = grid['Day_MP_Cases'].to_numpy(dtype=float).reshape(len(provs), -1)
+
+    # Recompute the means whose window includes a new day, from the raw counts a window before them
+    start = max(n_days - rolling_window_after(), 0)
+    context = max(start - (ROLLING_WINDOW - 1 - rolling_window_after()), 0)
+    old_rates = positivity_rate(updated['avg_mp_cases'][:, start:n_days], updated['avg_cases'][:, start:n_days])
+    for key, raw in [('avg_cases', 'day_cases'), ('avg_mp_cases', 'day_mp_cases')]:
+        means = centered_rolling_mean(updated[raw][:, context:]).astype(int)
+        updated[key][:, start:] = means[:, start - context:]
+    new_rates = positivity_rate(updated['avg_mp_cases'][:, start:], updated['avg_cases'][:, start:])
+
+    sorted_rates = np.full((len(provs), total_days), np.nan)
+    for row in range(len(provs)):
+        old_row = np.flatnonzero(rows == row)
+        if old_row.size:
+            current = state['sorted_rates'][old_row[0]]
+            current = current[~np.isnan(current)]
+            removed = np.sort(old_rates[row][~np.isnan(old_rates[row])])
+            # Equal rates are removed from consecutive positions
+            repeat = np.arange(len(removed)) - np.searchsorted(removed, removed)
+            current = np.delete(current, np.searchsorted(current, removed) + repeat)
+        else:
+            current = np.empty(0)
+        added = np.sort(new_rates[row][~np.isnan(new_rates[row])])
+        current = np.insert(current, np.searchsorted(current, added), added)
+        sorted_rates[row, :len(current)] = current
+    updated['sorted_rates'] = sorted_rates
+    return updated, start
+
+def state_frame(state, start=0):
+    """Detailed output rows of the state from day index start on."""
+    n_provs, n_days = state['day_cases'].shape
+    days = pd.date_range(start=pd.Timestamp(state['first_day'].item()), periods=n_days)[start:]
+    out_df = pd.DataFrame({
+        'prov': np.repeat(state['provs'], len(days)),
+        'days': np.tile(days, n_provs),
+        'Day_Cases': state['day_cases'][:, start:].ravel(),
+        'Day_MP_Cases': state['day_mp_cases'][:, start:].ravel(),
+        'Average_Day_Cases': state['avg_cases'][:, start:].ravel(),
+        'Average_Day_MP_Cases': state['avg_mp_cases'][:, start:].ravel(),
+    })
+    out_df['Average_Day_Positivity_Rate'] = positivity_rate(out_df['Average_Day_MP_Cases'], out_df['Average_Day_Cases'])
+    return out_df
+
+def calculate_n50(df, bootstrap=0, ci=0.95, seed=None, workers=1, chunk_size=100):
+    """
+    Daily rolling averages and N50 days of a prepared province x day table.
+
+    :return: detailed DataFrame (OUTPUT_COLUMNS) and N50 days DataFrame
+    """
+    global_min_date = df['days'].min()
+    global_max_date = df['days'].max()
+    full_date_range = pd.date_range(start=global_min_date, end=global_max_date)
+    final_df, provs = fill_missing_dates(df, full_date_range)
+    final_df = calculate_rolling_averages(final_df, len(provs), len(full_date_range))
+
+    rates = final_df['Average_Day_Positivity_Rate'].to_numpy(dtype=float).reshape(len(provs), len(full_date_range))
+    with phase('calculate_n50_days'):
+        final_n50_df = pd.DataFrame({'prov': provs, 'N50Days': calculate_n50_days(rates)})
+    if bootstrap:
+        day_cases = final_df['Day_Cases'].to_numpy(dtype=float).reshape(len(provs), len(full_date_range))
+        day_mp_cases = final_df['Day_MP_Cases'].to_numpy(dtype=float).reshape(len(provs), len(full_date_range))
+        final_n50_df = add_n50_ci(final_n50_df, day_cases, day_mp_cases, bootstrap, ci, seed, workers, chunk_size)
+    return final_df[OUTPUT_COLUMNS], final_n50_df
@@ -0,0 +1,92 @@
+"""
+Normalization of the monthly case counts to samples of SAMPLE_SIZE cases (01).
+"""
+import warnings
+import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from .profiling import stop_worker_tracing
+
+SAMPLE_SIZE = 1000
+NORMALIZED_COLUMNS = ['Normalized Cases', 'Normalized MP Cases', 'Normalized Positivity Rate']
+
+def resample_positive_cases(cases, mp_cases, k, rng):
+    """
+    Median number of positive cases over k resamples of SAMPLE_SIZE cases.
+
+    Each resample draws SAMPLE_SIZE distinct cases (hypergeometric) and then
+    SAMPLE_SIZE draws with replacement from them (binomial), for all rows at once.
+
+    :param cases: array of case counts, all larger than SAMPLE_SIZE
+    :param mp_cases: array of positive case counts
+    :param k: number of resamples per row
+    :param rng: numpy Generator
+    :return: array with the median positive count of each row
+    """
+    selected_positive = rng.hypergeometric(mp_cases, cases - mp_cases, SAMPLE_SIZE, size=(k, len(cases)))
+    positive_cases = rng.binomial(SAMPLE_SIZE, selected_positive / SAMPLE_SIZE)
+    return np.median(positive_cases, axis=0)
+
+def normalize_cases(df, k, seed=None):
+    """
+    Normalize the number of cases and positive cases.
+
+    :param df: DataFrame with 'Cases', 'MP Cases' and 'Positivity Rate' columns
+    :param k: number of times to repeat the random sampling
+    :param seed: seed or numpy Generator used for the random sampling
+    :return: DataFrame with normalized case count, normalized positive cases, and normalized positive rate
+    """
+    rng = np.random.default_rng(seed)
+    cases = pd.to_numeric(df['Cases'], errors='coerce').to_numpy(dtype=float)
+    mp_cases = pd.to_numeric(df['MP Cases'], errors='coerce').to_numpy(dtype=float)
+    rate = pd.to_numeric(df['Positivity Rate'], errors='coerce').to_numpy(dtype=float)
+    out = pd.DataFrame(np.nan, index=df.index, columns=NORMALIZED_COLUMNS)
+
+    # Case count is larger than 1000, perform random sampling; MP Cases outside 0..Cases are clipped,
+    # which gives the 0 or 1000 positives of sampling cases numbered below MP Cases
+    large = (cases > SAMPLE_SIZE) & ~np.isnan(mp_cases)
+    if large.any():
+        large_mp_cases = np.clip(mp_cases[large], 0, cases[large]).astype(np.int64)
+        normalized_positive_cases = resample_positive_cases(cases[large].astype(np.int64), large_mp_cases, k, rng)
+        out.loc[large, NORMALIZED_COLUMNS] = np.column_stack([np.full(large.sum(), SAMPLE_SIZE), normalized_positive_cases, normalized_positive_cases / SAMPLE_SIZE])
+
+    # Case count is less than or equal to 1000, scale up the total case count to 1000
+    small = (cases <= SAMPLE_SIZE) & ~np.isnan(rate)
+    if small.any():
+        out.loc[small, NORMALIZED_COLUMNS] = np.column_stack([np.full(small.sum(), SAMPLE_SIZE), np.trunc(rate[small] * SAMPLE_SIZE), rate[small]])
+
+    failed = ~(large | small)
+    if failed.any():
+        warnings.warn(f"Error normalizing rows: {df.index[failed].tolist()} - invalid 'Cases', 'MP Cases' or 'Positivity Rate'")
+    return out
+
+def _normalize_shard(task):
+    shard, k, seed_seq = task
+    return normalize_cases(shard, k, seed_seq)
+
+def normalize_cases_sharded(df, k, seed=None, workers=1, shard_size=1000):
+    """
+    Normalize the cases shard by shard, optionally in a process pool.
+
+    Every shard of shard_size rows gets its own SeedSequence.spawn child stream,
+    so the output only depends on the seed and shard_size, not on the number of workers.
+
+    :param df: DataFrame with 'Cases', 'MP Cases' and 'Positivity Rate' columns
+    :param k: number of times to repeat the random sampling
+    :param seed: seed of the random number generator
+    :param workers: number of worker processes
+    :param shard_size: number of rows per shard
+    :return: DataFrame with the normalized columns, in the original row order
+    """
+    starts = range(0, len(df), shard_size)
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(starts))
+    tasks = ((df.iloc[start:start + shard_size], k, seed_seq) for start, seed_seq in zip(starts, seed_seqs))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=stop_worker_tracing) as executor:
+            # map yields the shards back in submission order
+            results = list(executor.map(_normalize_shard, tasks))
+    else:
+        results = [_normalize_shard(task) for task in tasks]
+    if not results:
+        return pd.DataFrame(columns=NORMALIZED_COLUMNS, index=df.index, dtype=float)
+    return pd.concat(results)
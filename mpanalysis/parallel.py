@@ -0,0 +1,40 @@
+"""
+Seeded work in chunks, optionally in a process pool, shared by the bootstrap and permutation
+loops of the stages.
+"""
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from .profiling import stop_worker_tracing
+
+# Shared arguments of the chunks, only set inside the worker processes of a pool
+_worker_args = ()
+
+def _init_worker(args):
+    global _worker_args
+    stop_worker_tracing()
+    _worker_args = args
+
+def _run_worker(func, seed_seq, start, size):
+    return func(seed_seq, start, size, *_worker_args)
+
+def run_chunks(func, n, chunk_size, seed=None, workers=1, args=()):
+    """
+    Call func(seed_seq, start, size, *args) for the consecutive chunks of chunk_size of n items
+    (replicates or rows), in a process pool if workers > 1.
+
+    Every chunk draws from its own SeedSequence.spawn child stream, so the results only depend on
+    the seed and chunk_size, not on the number of workers. args are the data the chunks share, sent
+    once per worker process instead of once per chunk, and passed straight through without a pool.
+
+    :return: list of the results of the chunks, in chunk order
+    """
+    starts = range(0, n, chunk_size)
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(starts))
+    sizes = [min(chunk_size, n - start) for start in starts]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(args,)) as executor:
+            # map yields the results back in submission order
+            return list(executor.map(partial(_run_worker, func), seed_seqs, starts, sizes))
+    return [func(seed_seq, start, size, *args) for seed_seq, start, size in zip(seed_seqs, starts, sizes)]
@@ -0,0 +1,182 @@
+"""
+Phase timing and memory instrumentation shared by the scripts, enabled with --profile.
+
+    with phase('build cube', rows=len(df)):     time a named phase, optionally with counts
+        ...
+        count(groups=n_groups)                  add counts to the innermost open phase
+
+    @timed('read')                              time every call of a function as a phase
+
+Every phase records its wall and CPU seconds, the RSS after it, and the process high-water mark of
+the RSS after it with how much the phase raised it. The high-water mark never goes down, so a phase
+after a larger one reports the larger peak and a growth of 0. Nested phases are recorded with their
+parent path. The report is JSON or CSV (by extension); --cprofile additionally dumps cProfile stats
+of the run.
+
+--tracemalloc adds the tracemalloc allocation delta and peak of every phase (the per-phase memory
+peak). Tracing slows allocation-heavy code and imports several times over, so it is off by default
+to keep the wall times realistic. Pool workers stop the tracing they inherit, see stop_worker_tracing.
+
+While profiling is disabled phase() returns a shared no-op context and timed functions only
+check one flag, so the instrumentation can stay in place.
+"""
+import os
+import sys
+import json
+import time
+import functools
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+_NO_PHASE = nullcontext()
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.records = []
+        self._stack = []
+        self._cprofile = None
+        self._cprofile_path = None
+        self._start = None
+
+    def enable(self, cprofile_path=None, trace_memory=False):
+        self.enabled = True
+        self.trace_memory = trace_memory
+        self.records = []
+        self._start = time.perf_counter()
+        if trace_memory:
+            tracemalloc.start()
+        if cprofile_path:
+            import cProfile
+            self._cprofile, self._cprofile_path = cProfile.Profile(), cprofile_path
+            self._cprofile.enable()
+
+    def phase(self, name, **counts):
+        if not self.enabled:
+            return _NO_PHASE
+        return self._phase(name, counts)
+
+    @contextmanager
+    def _phase(self, name, counts):
+        path = '/'.join([frame['record']['phase'] for frame in self._stack] + [name])
+        record = {'phase': path, 'depth': len(self._stack), 'start_seconds': time.perf_counter() - self._start, **counts}
+        traced_before, traced_peak_before = tracemalloc.get_traced_memory()
+        process_peak_before = peak_rss_mb()
+        # The tracemalloc peak is process wide, the peak of the enclosing phase so far is kept aside
+        if self._stack:
+            self._stack[-1]['peak'] = max(self._stack[-1]['peak'], traced_peak_before)
+        tracemalloc.reset_peak()
+        frame = {'record': record, 'peak': 0}
+        self._stack.append(frame)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - wall
+            record['cpu_seconds'] = time.process_time() - cpu
+            traced, traced_peak = tracemalloc.get_traced_memory()
+            traced_peak = max(traced_peak, frame['peak'])
+            if self.trace_memory:
+                record['traced_delta_mb'] = (traced - traced_before) / 2 ** 20
+                record['traced_peak_mb'] = (traced_peak - traced_before) / 2 ** 20
+            record['rss_mb'] = current_rss_mb()
+            record['process_peak_rss_mb'] = peak_rss_mb()
+            if process_peak_before is not None:
+                record['process_peak_rss_growth_mb'] = record['process_peak_rss_mb'] - process_peak_before
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], traced_peak)
+            self.records.append(record)
+
+    def count(self, **counts):
+        """Add counts, e.g. rows or groups, to the innermost open phase."""
+        if self.enabled and self._stack:
+            self._stack[-1]['record'].update(counts)
+
+    def write_report(self, path):
+        """Write the phases in the order they started, as JSON or CSV by the extension of path."""
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self._cprofile_path)
+        records = sorted(self.records, key=lambda record: record['start_seconds'])
+        if str(path).lower().endswith('.csv'):
+            import pandas as pd
+            pd.DataFrame(records).to_csv(path, index=False)
+        else:
+            report = {
+                'command': sys.argv,
+                'total_seconds': time.perf_counter() - self._start,
+                'process_peak_rss_mb': peak_rss_mb(),
+                'phases': records,
+            }
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2, default=str)
+
+PROFILER = Profiler()
+
+def phase(name, **counts):
+    """Context manager timing a named phase of the shared profiler."""
+    return PROFILER.phase(name, **counts)
+
+def count(**counts):
+    PROFILER.count(**counts)
+
+def timed(name=None):
+    """Decorator timing every call of a function as a phase, named after the function by default."""
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            with PROFILER.phase(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def current_rss_mb():
+    """Resident set size of this process, None where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+def peak_rss_mb():
+    """High-water mark of the resident set size of this process, None where resource is not available."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+def stop_worker_tracing():
+    """
+    Pool initializer: stop the tracemalloc tracing a forked worker inherits from a profiled parent.
+
+    The worker's traces are never reported, so tracing there would only slow it down.
+    """
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def add_profile_arguments(parser):
+    parser.add_argument('--profile', type=str, default=None, metavar='REPORT',
+                        help='Write phase timings, memory and counts to this report (.json or .csv)')
+    parser.add_argument('--cprofile', type=str, default=None, metavar='FILE',
+                        help='With --profile, also dump cProfile stats of the run to this file')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='With --profile, also record the tracemalloc allocations and peak of every phase (slows the run down)')
+
+def start_profiling(args):
+    """Enable the shared profiler if --profile was given."""
+    if args.profile:
+        PROFILER.enable(args.cprofile, args.tracemalloc)
+
+def finish_profiling(args):
+    if args.profile:
+        PROFILER.write_report(args.profile)
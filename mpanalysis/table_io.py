@@ -0,0 +1,109 @@
+"""
+Table I/O shared by the analysis scripts, the format is picked from the file extension:
+
+    .parquet / .pq              Parquet through pyarrow, column projection and categorical columns are kept
+    .csv / .tsv / .txt          delimited text (.txt is tab separated), optionally compressed with
+                                .gz / .bz2 / .xz / .zst / .zip
+    .xlsx / .xls                Excel, meant for the final human-facing report only
+
+Parquet or compressed CSV is the format of choice for intermediate tables, Excel parsing and
+writing are far slower than the analyses themselves on the national tables.
+"""
+import os
+import re
+import pandas as pd
+from .profiling import timed, count
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+TEXT_SEPARATORS = {'.csv': ',', '.tsv': '\t', '.txt': '\t'}
+COMPRESSION_EXTENSIONS = ('.gz', '.bz2', '.xz', '.zst', '.zip')
+
+def table_format(path):
+    """Format ('parquet', 'excel' or 'text') and separator of text files, from the extension of path."""
+    root, ext = os.path.splitext(str(path).lower())
+    if ext in COMPRESSION_EXTENSIONS:
+        root, ext = os.path.splitext(root)
+        if ext not in TEXT_SEPARATORS:
+            raise ValueError(f"Unsupported file format of {path}, only csv, tsv and txt files can be compressed")
+    if ext in PARQUET_EXTENSIONS:
+        return 'parquet', None
+    if ext in EXCEL_EXTENSIONS:
+        return 'excel', None
+    if ext in TEXT_SEPARATORS:
+        return 'text', TEXT_SEPARATORS[ext]
+    raise ValueError(f"Unsupported file format of {path}, use parquet, csv/tsv/txt (optionally compressed) or xls/xlsx")
+
+@timed('read_table')
+def read_table(path, columns=None, categories=None, sep=None, **kwargs):
+    """
+    Read a table, only the columns in columns (all if None).
+
+    :param categories: columns to read as pandas categoricals
+    :param sep: separator of text files, by default from the extension
+    :param kwargs: passed to the pandas reader of the format
+    """
+    fmt, default_sep = table_format(path)
+    if fmt == 'parquet':
+        df = pd.read_parquet(path, engine='pyarrow', columns=columns, **kwargs)
+    elif fmt == 'excel':
+        df = pd.read_excel(path, usecols=columns, **kwargs)
+    else:
+        dtype = kwargs.pop('dtype', {})
+        if categories:
+            dtype = {**dtype, **{column: 'category' for column in categories}}
+        df = pd.read_csv(path, sep=sep or default_sep, usecols=columns, dtype=dtype or None, **kwargs)
+    for column in categories or []:
+        if df[column].dtype != 'category':
+            df[column] = df[column].astype('category')
+    count(rows=len(df), columns=df.shape[1])
+    return df
+
+def iter_table(path, chunksize, columns=None, sep=None, **kwargs):
+    """Read a parquet or text table in chunks of about chunksize rows."""
+    fmt, default_sep = table_format(path)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    elif fmt == 'text':
+        yield from pd.read_csv(path, sep=sep or default_sep, usecols=columns, chunksize=chunksize, **kwargs)
+    else:
+        raise ValueError(f"Excel files can not be read in chunks, convert {path} to parquet or csv")
+
+@timed('write_table')
+def write_table(df, path, index=False, sep=None, **kwargs):
+    """Write a table in the format of the extension of path."""
+    count(rows=len(df), columns=df.shape[1])
+    fmt, default_sep = table_format(path)
+    if fmt == 'parquet':
+        df.to_parquet(path, engine='pyarrow', index=index, **kwargs)
+    elif fmt == 'excel':
+        df.to_excel(path, index=index, **kwargs)
+    else:
+        df.to_csv(path, sep=sep or default_sep, index=index, **kwargs)
+
+def sheet_path(path, sheet_name):
+    """File of one sheet of a report written to a non-Excel path: <name>_<sheet name><extension>."""
+    name = os.path.basename(str(path))
+    stem, ext = name.split('.', 1) if '.' in name else (name, '')
+    slug = re.sub(r'[^0-9A-Za-z]+', '_', sheet_name).strip('_')
+    return os.path.join(os.path.dirname(str(path)), f"{stem}_{slug}.{ext}")
+
+@timed('write_report')
+def write_report(sheets, path, index=False):
+    """
+    Write {sheet name: DataFrame} as one Excel workbook, or one file per sheet for the other formats.
+
+    :param index: whether to write the index, or the names of the sheets whose index is written
+    """
+    def keep_index(sheet_name):
+        return index if isinstance(index, bool) else sheet_name in index
+
+    if table_format(path)[0] == 'excel':
+        with pd.ExcelWriter(path) as writer:
+            for sheet_name, df in sheets.items():
+                df.to_excel(writer, sheet_name=sheet_name[:31], index=keep_index(sheet_name))
+    else:
+        for sheet_name, df in sheets.items():
+            write_table(df, sheet_path(path, sheet_name), index=keep_index(sheet_name))
@@ -0,0 +1,217 @@
+"""
+Run the numbered stages as one cached pipeline.
+
+    01 normalize -> 02 epidemic          normalized cases -> AAP and epidemic status
+    03 n50       -> 05 geodetector       N50 days per province, joined to a factor table as y
+    04 coinfection                       co-infection statistics
+    06 logistic                          per-pathogen logistic regression
+
+Stages call the mpanalysis functions and pass DataFrames in memory. Every stage output is cached
+as Parquet under a key hashing the code (the mpanalysis package and this file), its input files,
+its parameters and the keys of its upstream stages, so a rerun only recomputes the stages whose
+inputs changed. The four branches run concurrently.
+"""
+import os
+import json
+import hashlib
+import argparse
+import glob
+import functools
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import mpanalysis
+from mpanalysis import api, coinfection, geodetector
+from mpanalysis.table_io import read_table, write_table, write_report
+
+CACHE_DIR = '.pipeline_cache'
+DONE_FILE = 'done'
+
+# files and params name the config entries the stage reads; a stage runs when all its files are given
+Stage = namedtuple('Stage', ['name', 'upstream', 'files', 'params', 'report'])
+
+STAGES = {
+    'normalize': Stage('normalize', None, ['cases'], ['k', 'seed', 'shard_size'], False),
+    'epidemic': Stage('epidemic', 'normalize', [], ['window_start', 'window_end', 'threshold'], True),
+    'n50': Stage('n50', None, ['days'], [], True),
+    'geodetector': Stage('geodetector', 'n50', ['factors'], ['permutations', 'bootstrap', 'seed'], True),
+    'coinfection': Stage('coinfection', None, ['coinfection', 'blist'], ['groupings'], True),
+    'logistic': Stage('logistic', None, ['logistic'], ['fraction', 'compress'], True),
+}
+BRANCHES = [('normalize', 'epidemic'), ('n50', 'geodetector'), ('coinfection',), ('logistic',)]
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+@functools.lru_cache(maxsize=None)
+def code_digest():
+    """Digest of the sources of the mpanalysis package and of this file, which every stage runs."""
+    package = os.path.dirname(os.path.abspath(mpanalysis.__file__))
+    sources = sorted(glob.glob(os.path.join(package, '*.py'))) + [os.path.abspath(__file__)]
+    digest = hashlib.sha256()
+    for path in sources:
+        digest.update(os.path.basename(path).encode())
+        digest.update(file_digest(path).encode())
+    return digest.hexdigest()
+
+def stage_key(stage, config, upstream_key=None):
+    """Cache key of a stage: hash of the code, its input files, parameters and upstream key."""
+    payload = {
+        'stage': stage.name,
+        'code': code_digest(),
+        'files': {name: file_digest(config[name]) for name in stage.files},
+        'params': {name: config[name] for name in stage.params},
+        'upstream': upstream_key,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def cache_path(config, stage, key):
+    return os.path.join(config['cache_dir'], f'{stage.name}-{key}')
+
+def is_cached(path):
+    return os.path.exists(os.path.join(path, DONE_FILE))
+
+def load_cached(path):
+    """{table name: DataFrame} of a cached stage output."""
+    with open(os.path.join(path, DONE_FILE)) as f:
+        names = json.load(f)
+    return {name: read_table(os.path.join(path, f'{i}.parquet')) for i, name in enumerate(names)}
+
+def save_cached(path, outputs):
+    os.makedirs(path, exist_ok=True)
+    for i, df in enumerate(outputs.values()):
+        # Parquet keeps the index, e.g. the factor names of the detector tables
+        write_table(df, os.path.join(path, f'{i}.parquet'), index=None)
+    # Written last, a stage interrupted while saving is recomputed
+    with open(os.path.join(path, DONE_FILE), 'w') as f:
+        json.dump(list(outputs), f)
+
+def run_stage(name, config, upstream):
+    """Outputs of one stage as {table name: DataFrame}, upstream are the outputs of its upstream stage."""
+    if name == 'normalize':
+        return {'Normalized': api.normalize_table(read_table(config['cases']), config['k'], config['seed'],
+                                                  config['workers'], config['shard_size'])}
+    if name == 'epidemic':
+        return {'Epidemic': api.epidemic_table(upstream['Normalized'], config['window_start'], config['window_end'], config['threshold'])}
+    if name == 'n50':
+        detail, n50 = api.n50_tables(read_table(config['days']))
+        return {'Daily': detail, 'N50': n50}
+    if name == 'geodetector':
+        # N50 days are y, the first column, of the factors of the same province
+        factors = read_table(config['factors'])
+        df = upstream['N50'][['prov', 'N50Days']].merge(factors, on='prov').drop(columns='prov')
+        return api.geodetector_tables(df, config['permutations'], config['bootstrap'], config['workers'], config['seed'])
+    if name == 'coinfection':
+        with open(config['blist']) as f:
+            blist = [line.strip() for line in f]
+        _, keys = coinfection.parse_groupings(config['groupings'])
+        return coinfection.coinfection_statistics(coinfection.read_txt_file(config['coinfection'], keys), blist, config['groupings'])
+    if name == 'logistic':
+        results, failures = api.logistic_table(read_table(config['logistic']), config['fraction'], config['compress'], config['workers'])
+        for bacteria, error in failures:
+            print(f"Failed to fit model for {bacteria}: {error}")
+        return {'Logistic': results}
+    raise ValueError(f'Unknown stage [{name}]')
+
+def report_path(name, config):
+    return os.path.join(config['output_dir'], f"{name}.{config['report_format']}")
+
+def report_is_current(name, config, key):
+    """Whether the report of a stage in the output directory was written for this key."""
+    key_file = report_path(name, config) + '.key'
+    if not os.path.exists(key_file):
+        return False
+    with open(key_file) as f:
+        return f.read() == key
+
+def write_stage_report(name, config, key, outputs):
+    path = report_path(name, config)
+    os.makedirs(config['output_dir'], exist_ok=True)
+    index = False
+    if name == 'geodetector':
+        index = [sheet for sheet in outputs if sheet not in geodetector.UNINDEXED_SHEETS]
+    write_report(outputs, path, index=index)
+    with open(path + '.key', 'w') as f:
+        f.write(key)
+
+def run_branch(branch, config):
+    """
+    Run the stages of a branch in order. Cached outputs are only loaded when a later stage of
+    the branch is recomputed or a report is not current.
+
+    :return: list of (stage, key, 'computed', 'cached' or 'skipped')
+    """
+    log = []
+    upstream_key, upstream_outputs, upstream_path = None, None, None
+    for name in branch:
+        stage = STAGES[name]
+        missing = [file for file in stage.files if not config.get(file)]
+        if missing or (stage.upstream and upstream_key is None):
+            log.append((name, None, 'skipped'))
+            upstream_key = None
+            continue
+        key = stage_key(stage, config, upstream_key)
+        path = cache_path(config, stage, key)
+        outputs = None
+        if config['force'] or not is_cached(path):
+            if stage.upstream and upstream_outputs is None:
+                upstream_outputs = load_cached(upstream_path)
+            outputs = run_stage(name, config, upstream_outputs)
+            save_cached(path, outputs)
+            log.append((name, key, 'computed'))
+        else:
+            log.append((name, key, 'cached'))
+        if stage.report and (outputs is not None or not report_is_current(name, config, key)):
+            write_stage_report(name, config, key, outputs if outputs is not None else load_cached(path))
+        upstream_key, upstream_outputs, upstream_path = key, outputs, path
+    return log
+
+def run_pipeline(config, jobs=None):
+    """Run every branch, concurrently in up to jobs processes, and return the log of all stages."""
+    jobs = jobs or len(BRANCHES)
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            logs = list(executor.map(run_branch, BRANCHES, [config] * len(BRANCHES)))
+    else:
+        logs = [run_branch(branch, config) for branch in BRANCHES]
+    return [entry for log in logs for entry in log]
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Run the analysis stages as one cached pipeline, stages without input files are skipped.')
+    parser.add_argument('--cases', type=str, default=None, help='Input of 01: cases per province and month')
+    parser.add_argument('--days', type=str, default=None, help='Input of 03: cases per province and day')
+    parser.add_argument('--factors', type=str, default=None, help='Factor table of 05 with a prov column, y is the N50 days of 03')
+    parser.add_argument('--coinfection', type=str, default=None, help='Input of 04: co-infection rows')
+    parser.add_argument('--blist', type=str, default=None, help='List file of 04: pathogens to report')
+    parser.add_argument('--logistic', type=str, default=None, help='Input of 06: binary pathogen matrix')
+    parser.add_argument('-o', '--output-dir', type=str, default='result', help='Directory of the stage reports, default is %(default)s')
+    parser.add_argument('--report-format', type=str, default='xlsx', help='Extension of the stage reports (xlsx, parquet, csv), default is %(default)s')
+    parser.add_argument('--cache-dir', type=str, default=CACHE_DIR, help='Directory of the cached stage outputs, default is %(default)s')
+    parser.add_argument('--force', action='store_true', help='Recompute every stage, ignoring the cache')
+    parser.add_argument('--jobs', type=int, default=None, help='Number of branches run concurrently, default is all of them')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes inside the stages of 01, 05 and 06, default is 1')
+    parser.add_argument('-k', type=int, default=1000, help='Resamples of 01, default is %(default)s')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of 01 and of the 05 significance tests, default is %(default)s')
+    parser.add_argument('--shard-size', type=int, default=1000, help='Rows per random stream of 01, default is %(default)s')
+    parser.add_argument('--window-start', type=str, default='2023-04', help='First month of the 02 window, default is %(default)s')
+    parser.add_argument('--window-end', type=str, default='2024-03', help='Last month of the 02 window, default is %(default)s')
+    parser.add_argument('--threshold', type=float, default=0.75, help='CumAAP threshold of 02, default is %(default)s')
+    parser.add_argument('--permutations', type=int, default=0, help='Permutations of the 05 significance tests, default is 0')
+    parser.add_argument('--bootstrap', type=int, default=0, help='Bootstrap resamples of the 05 significance tests, default is 0')
+    parser.add_argument('--groupings', nargs='+', default=['Province', 'InfectionSite', 'AgeGroup', 'Gender'],
+                        help='Groupings of 04, combine keys with "+", default is %(default)s')
+    parser.add_argument('-f', '--fraction', type=float, default=1, help='Sample fraction of 06, default is 1')
+    parser.add_argument('-c', '--compress', action='store_true', help='Fit the 06 models on collapsed identical rows')
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    config = vars(args)
+    for name, key, status in run_pipeline(config, args.jobs):
+        print(f"{name:12s} {status:9s} {key or ''}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Seeded synthetic inputs of every stage, at any scale.
+
+    province_months   01 input: cases, MP cases and positivity rate per province and month
+    province_days     03 input: cases and MP cases per province (or county) and day
+    coinfection_rows  04 input: one row per stratum with a multi-pathogen BacteriaList
+    pathogen_matrix   06 input: binary pathogen indicators and covariates per case
+    factor_table      05 input: y and stratified factors, also written with a prov column for the pipeline
+
+Every table follows an epidemic wave with a province-specific peak, so the AAP, N50 and regression
+stages see realistic structure. The same seed and sizes always give the same tables.
+"""
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from mpanalysis.table_io import write_table, table_format
+
+MP = 'Mycoplasma pneumoniae'
+PATHOGENS = [MP, 'Human respiratory syncytial virus', 'Human parainfluenza virus', 'Human herpesvirus', 'Human adenovirus',
+             'Influenza A virus', 'Influenza B virus', 'Influenza C virus', 'Echovirus', 'Human metapneumovirus',
+             'Epstein-Barr virus', 'Human parvovirus B19', 'Coxsackievirus A and B', 'Coronavirus', 'Human bocavirus', 'Enterovirus']
+PROVINCES = ['Neimengol', 'Heilongjiang', 'Jilin', 'Liaoning', 'Beijing', 'Tianjin', 'Hebei', 'Shanxi', 'Shaanxi', 'Gansu',
+             'Ningxia', 'Henan', 'Shandong', 'Xinjiang', 'Jiangsu', 'Anhui', 'Hubei', 'Sichuan', 'Chongqing', 'Yunnan',
+             'Guizhou', 'Guangxi', 'Guangdong', 'Fujian', 'Zhejiang', 'Jiangxi', 'Hunan', 'Hainan', 'Shanghai']
+
+def epidemic_wave(n_units, n_periods, rng, base=0.05, amplitude=0.5, width=0.12):
+    """units x periods array of MP positivity: a baseline plus one Gaussian wave with a random peak per unit."""
+    peaks = rng.uniform(0.3, 0.8, size=(n_units, 1)) * n_periods
+    positions = np.arange(n_periods)
+    wave = np.exp(-0.5 * ((positions - peaks) / (width * n_periods)) ** 2)
+    return np.clip(base + amplitude * rng.uniform(0.5, 1, size=(n_units, 1)) * wave, 0, 1)
+
+def province_months(n_provs=31, n_months=24, start='2022-04', seed=None):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start=start, periods=n_months, freq='MS')
+    # Case volumes on both sides of the 1000-case sample size of 01
+    cases = rng.lognormal(np.log(3000), 1.2, size=(n_provs, n_months)).astype(np.int64) + 1
+    mp_cases = rng.binomial(cases, epidemic_wave(n_provs, n_months, rng))
+    return pd.DataFrame({
+        'prov': np.repeat(np.arange(1, n_provs + 1), n_months),
+        'dates': np.tile(dates.strftime('%Y-%m-%d'), n_provs),
+        'Cases': cases.ravel(),
+        'MP Cases': mp_cases.ravel(),
+        'Positivity Rate': (mp_cases / cases).ravel(),
+    })
+
+def province_days(n_units=31, n_days=365, start='2023-01-01', missing=0.02, seed=None):
+    """Daily counts of n_units provinces or counties, a fraction missing of the days is left out."""
+    rng = np.random.default_rng(seed)
+    days = pd.date_range(start=start, periods=n_days)
+    cases = rng.poisson(rng.lognormal(np.log(80), 1, size=(n_units, 1)), size=(n_units, n_days))
+    mp_cases = rng.binomial(cases, epidemic_wave(n_units, n_days, rng))
+    df = pd.DataFrame({
+        'prov': np.repeat(np.arange(1, n_units + 1), n_days),
+        'days': np.tile(days.strftime('%Y-%m-%d'), n_units),
+        'Day_Cases': cases.ravel(),
+        'Day_MP_Cases': mp_cases.ravel(),
+    })
+    return df[rng.random(len(df)) >= missing].reset_index(drop=True)
+
+def coinfection_rows(n_rows=10000, n_pathogens=len(PATHOGENS), mean_pathogens=2.5, seed=None):
+    """04 input rows: every row lists 1 + Poisson(mean_pathogens - 1) distinct pathogens, MP in about a third."""
+    rng = np.random.default_rng(seed)
+    pathogens = np.array(PATHOGENS[:n_pathogens] + [f'Pathogen {i}' for i in range(len(PATHOGENS), n_pathogens)])
+    weights = rng.dirichlet(np.ones(len(pathogens)) * 2)
+    n_listed = np.minimum(1 + rng.poisson(mean_pathogens - 1, n_rows), len(pathogens))
+    # Distinct pathogens per row: the n_listed largest of the weighted random keys u ** (1 / weight)
+    keys = rng.random((n_rows, len(pathogens))) ** (1 / weights)
+    ranks = np.argsort(-keys, axis=1)
+    bacteria = [';'.join(pathogens[row[:n]]) for row, n in zip(ranks, n_listed)]
+    months = pd.date_range('2023-01-01', periods=12, freq='MS').strftime('%y-%b')
+    return pd.DataFrame({
+        'Province': rng.choice(PROVINCES, n_rows),
+        'Time': rng.choice(months, n_rows),
+        'InfectionSite': rng.choice(['L', 'U'], n_rows),
+        'AgeGroup': rng.integers(0, 90, n_rows),
+        'Gender': rng.choice(['F', 'M'], n_rows),
+        'BacteriaList': bacteria,
+        'CaseCount': rng.integers(1, 100, n_rows),
+    })
+
+def pathogen_matrix(n_rows=10000, n_pathogens=10, seed=None):
+    """06 input: MP follows a logistic model of the covariates and the other pathogens."""
+    rng = np.random.default_rng(seed)
+    names = (PATHOGENS[1:] + [f'Pathogen {i}' for i in range(len(PATHOGENS), n_pathogens + 1)])[:n_pathogens]
+    covariates = rng.integers(0, 2, size=(n_rows, 4))
+    pathogens = (rng.random((n_rows, n_pathogens)) < rng.uniform(0.05, 0.4, n_pathogens)).astype(int)
+    logit = -0.5 + covariates @ rng.normal(0, 0.3, 4) + pathogens @ rng.normal(0, 0.5, n_pathogens)
+    df = pd.DataFrame({
+        'date': rng.choice(pd.date_range('2023-01-01', periods=12, freq='MS').strftime('%Y-%m'), n_rows),
+        MP: (rng.random(n_rows) < 1 / (1 + np.exp(-logit))).astype(int),
+    })
+    df[['region', 'site', 'age', 'sex']] = covariates
+    df[names] = pathogens
+    return df
+
+def factor_table(n_rows=31, n_factors=6, n_strata=5, seed=None):
+    """05 input: y (first column) depends on the first two factors, the others are noise."""
+    rng = np.random.default_rng(seed)
+    factors = rng.integers(1, n_strata + 1, size=(n_rows, n_factors))
+    effects = rng.normal(0, 10, size=(min(2, n_factors), n_strata + 1))
+    y = 50 + sum(effects[i][factors[:, i]] for i in range(len(effects))) + rng.normal(0, 5, n_rows)
+    df = pd.DataFrame(factors, columns=[f'f{i}' for i in range(n_factors)])
+    df.insert(0, 'N50', np.round(y, 1))
+    return df
+
+def write_inputs(output_dir, scale=1, seed=None, fmt='parquet'):
+    """Write every stage input at scale times the sample sizes, returns {stage: path}."""
+    os.makedirs(output_dir, exist_ok=True)
+    seeds = np.random.SeedSequence(seed).spawn(5)
+    geodetector = factor_table(n_rows=31 * scale, seed=seeds[4])
+    tables = {
+        'cases': province_months(n_provs=31 * scale, seed=seeds[0]),
+        'days': province_days(n_units=31 * scale, seed=seeds[1]),
+        'coinfection': coinfection_rows(n_rows=10000 * scale, seed=seeds[2]),
+        'logistic': pathogen_matrix(n_rows=10000 * scale, seed=seeds[3]),
+        'geodetector': geodetector,
+        # Factors of the provinces of province_days, the pipeline takes y from 03
+        'factors': geodetector.drop(columns='N50').assign(prov=np.arange(1, len(geodetector) + 1)),
+    }
+    paths = {}
+    for name, df in tables.items():
+        paths[name] = os.path.join(output_dir, f'{name}.{fmt}')
+        if name == 'coinfection' and table_format(paths[name])[0] == 'text':
+            # Text inputs of 04 have a title line above the header
+            lines = pd.DataFrame([['co-infection'] + [''] * (df.shape[1] - 1), list(df.columns)], columns=df.columns)
+            write_table(pd.concat([lines, df]), paths[name], header=False)
+        else:
+            write_table(df, paths[name])
+    paths['blist'] = os.path.join(output_dir, 'blist.txt')
+    with open(paths['blist'], 'w') as f:
+        f.write('\n'.join(PATHOGENS) + '\n')
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description='Write seeded synthetic inputs of every stage.')
+    parser.add_argument('output_dir', type=str, help='Directory of the generated inputs')
+    parser.add_argument('--scale', type=int, default=1, help='Multiple of the sample sizes (31 provinces, 10000 rows), default is 1')
+    parser.add_argument('--seed', type=int, default=1, help='Seed, default is %(default)s')
+    parser.add_argument('--format', type=str, default='parquet', help='File extension of the tables (parquet, csv, csv.gz, xlsx), default is %(default)s')
+    args = parser.parse_args()
+    for name, path in write_inputs(args.output_dir, args.scale, args.seed, args.format).items():
+        print(f'{name:12s} {path}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+import numpy as np
+import pytest
+from mpanalysis import geodetector
+
+@pytest.mark.parametrize('low', [0.5, -20.0])
+def test_geometric_classes_do_not_depend_on_units(low):
+    rng = np.random.default_rng(4)
+    values = low + rng.gamma(2, 10, 500)
+    for n_classes in range(3, 8):
+        codes = geodetector.discretize(values, 'geometric', n_classes)
+        np.testing.assert_array_equal(geodetector.discretize(values * 10, 'geometric', n_classes), codes)
+        np.testing.assert_array_equal(geodetector.discretize(values / 1000, 'geometric', n_classes), codes)
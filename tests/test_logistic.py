@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import statsmodels.api as sm
+from mpanalysis import logistic
+
+def coinfection_rows(n, rng):
+    """Covariates, five binary pathogens with some shared positives and MP with one true interaction."""
+    df = pd.DataFrame({
+        'region': rng.integers(1, 4, n),
+        'site': rng.integers(1, 3, n),
+        'age': rng.integers(1, 6, n),
+        'sex': rng.integers(1, 3, n),
+    })
+    for k in range(5):
+        df[f'B{k}'] = (rng.random(n) < 0.3).astype(int)
+    eta = -1 + 0.2 * df['age'] + 0.5 * df['B0'] - 0.4 * df['B1'] + 1.5 * df['B0'] * df['B2']
+    df[logistic.Y_NAME] = (rng.random(n) < 1 / (1 + np.exp(-eta))).astype(int)
+    return df
+
+def test_score_test_pairs_matches_statsmodels():
+    df = coinfection_rows(600, np.random.default_rng(3))
+    bacteria_vars = [f'B{k}' for k in range(5)]
+    X = sm.add_constant(df[logistic.COVARIATES].astype(float)).to_numpy()
+    P = df[bacteria_vars].to_numpy(dtype=float)
+    y = df[logistic.Y_NAME].to_numpy(dtype=float)
+    model = sm.GLM(y, np.hstack([X, P]), family=sm.families.Binomial())
+    params = model.fit().params
+
+    i, j, statistic, p_value = logistic.score_test_pairs(X, y, P, params)
+    for a, b, s, p in zip(i, j, statistic, p_value):
+        expected = model.score_test(params, exog_extra=(P[:, a] * P[:, b])[:, None])
+        np.testing.assert_allclose([s, p], np.ravel(expected[:2]), rtol=1e-6)
+
+def test_screen_fits_the_screened_model_and_drops_constant_columns():
+    df = coinfection_rows(600, np.random.default_rng(5))
+    df['B5'] = 0
+    df['B6'] = df['B1']
+    bacteria_vars = [f'B{k}' for k in range(7)]
+    out_df, failures = logistic.screen_interactions(df, bacteria_vars, alpha=1)
+
+    assert sorted(names for names, _ in failures) == [('B5',), ('B6',)]
+    assert len(out_df) == 10
+    # Every pair is refitted on the covariates, all kept pathogens and the interaction
+    kept = [f'B{k}' for k in range(5)]
+    row = out_df[(out_df['Bacteria 1'] == 'B0') & (out_df['Bacteria 2'] == 'B2')].iloc[0]
+    X = df[logistic.COVARIATES + kept].assign(Interaction=df['B0'] * df['B2'])
+    model = sm.Logit(df[logistic.Y_NAME], sm.add_constant(X)).fit(disp=0)
+    np.testing.assert_allclose(row[['Coefficient', 'P-value']].to_numpy(dtype=float),
+                               [model.params['Interaction'], model.pvalues['Interaction']], rtol=1e-6)
+
+def test_compressed_fit_matches_logit_and_flags_separation():
+    rng = np.random.default_rng(8)
+    df = coinfection_rows(2000, rng)
+    # Only seen in MP positive rows, its coefficient diverges
+    df['Separated'] = ((df[logistic.Y_NAME] == 1) & (rng.random(len(df)) < 0.05)).astype(int)
+    columns = [logistic.Y_NAME] + logistic.COVARIATES + ['B0', 'Separated']
+    matrix = df[columns].to_numpy(dtype=float)
+
+    full, error = logistic.fit_bacteria(matrix, columns, 'B0')
+    compressed, compressed_error = logistic.fit_bacteria(matrix, columns, 'B0', compress=True)
+    assert error is None and compressed_error is None
+    for name in ['Coefficient', 'Std Err', 'CI Lower (0.025)', 'CI Upper (0.975)']:
+        np.testing.assert_allclose(compressed[name], full[name], rtol=1e-6)
+
+    for compress in [False, True]:
+        assert logistic.fit_bacteria(matrix, columns, 'Separated', compress=compress) == (None, 'model did not converge')
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+from mpanalysis import n50
+
+def daily_counts(provs, days, rng):
+    """Small daily counts, so the rolling averages and rates have many ties; 5% of the days are missing."""
+    df = pd.DataFrame({
+        'prov': np.repeat(provs, len(days)),
+        'days': np.tile(days.strftime('%Y-%m-%d'), len(provs)),
+        'Day_Cases': rng.poisson(6, len(provs) * len(days)),
+    })
+    df['Day_MP_Cases'] = rng.binomial(df['Day_Cases'], 0.3)
+    return df[rng.random(len(df)) >= 0.05].reset_index(drop=True)
+
+@pytest.mark.parametrize('names', [False, True])
+def test_incremental_matches_full_run(tmp_path, names):
+    rng = np.random.default_rng(7)
+    provs = [f'P{i}' for i in range(1, 21)] if names else list(range(1, 21))
+    late = ['P99'] if names else [99]
+    # The last province is first reported in the last batch
+    df = pd.concat([daily_counts(provs, pd.date_range('2023-01-01', periods=120), rng),
+                    daily_counts(late, pd.date_range('2023-04-20', periods=11), rng)])
+    df = n50.prepare_data(df)
+    detail, expected = n50.calculate_n50(df)
+
+    # First 60 days, then daily batches of 15 and 30 days, saved and loaded between the runs
+    path = tmp_path / 'state.npz'
+    cuts = pd.to_datetime(['2023-03-01', '2023-03-16', '2023-04-15', '2023-05-01'])
+    n50.save_state(path, n50.new_state(df[df['days'] < cuts[0]]))
+    for start, end in zip(cuts[:-1], cuts[1:]):
+        state, _ = n50.update_state(n50.load_state(path), df[(df['days'] >= start) & (df['days'] < end)])
+        n50.save_state(path, state)
+
+    state = n50.load_state(path)
+    assert list(state['provs']) == list(expected['prov'])
+    np.testing.assert_array_equal(n50.state_n50_days(state), expected['N50Days'].to_numpy())
+    frame = n50.state_frame(state)
+    np.testing.assert_array_equal(frame['Average_Day_Positivity_Rate'].to_numpy(dtype=float),
+                                  detail['Average_Day_Positivity_Rate'].to_numpy(dtype=float))
+
+def test_n50_from_sorted_matches_calculate_n50_days():
+    rng = np.random.default_rng(1)
+    rates = rng.choice([0.1, 0.2, 0.3, 1 / 3, 0.7], size=(5000, 10))
+    rates[rng.random(rates.shape) < 0.1] = np.nan
+    rates[:5, 3] = np.inf
+    np.testing.assert_array_equal(n50.n50_from_sorted(np.sort(rates, axis=1), rates), n50.calculate_n50_days(rates))
+
+def test_state_path_without_suffix(tmp_path):
+    rng = np.random.default_rng(2)
+    df = n50.prepare_data(daily_counts(list(range(1, 4)), pd.date_range('2023-01-01', periods=30), rng))
+    state = n50.new_state(df)
+
+    # The state is written to the path as given, so the existence check of the next run finds it
+    path = tmp_path / 'state'
+    n50.save_state(path, state)
+    assert path.exists() and not (tmp_path / 'state.npz').exists()
+    loaded = n50.load_state(path)
+    np.testing.assert_array_equal(n50.state_n50_days(loaded), n50.state_n50_days(state))
+
+def test_bootstrap_ci_covers_the_n50_days():
+    rng = np.random.default_rng(11)
+    df = daily_counts(list(range(1, 21)), pd.date_range('2023-01-01', periods=90), rng)
+    # Some days report more MP cases than cases, like the sample data
+    over = rng.random(len(df)) < 0.1
+    df.loc[over, 'Day_MP_Cases'] = df.loc[over, 'Day_Cases'] + rng.integers(1, 5, over.sum())
+    with pytest.warns(UserWarning, match='more MP cases than cases'):
+        _, n50_df = n50.calculate_n50(n50.prepare_data(df), bootstrap=200, seed=3)
+    covered = (n50_df['N50Days_lower'] <= n50_df['N50Days']) & (n50_df['N50Days'] <= n50_df['N50Days_upper'])
+    assert covered.mean() >= 0.9